@@ -0,0 +1,137 @@
+"""
+This file contains the batched versions of the DTW distance and lower bounding measures,
+comparing one query against every row of an (N, L) candidate matrix at once.
+
+Author:
+- Artur Dandolini Pescador
+"""
+
+import numpy as np
+from envelope import compute_envelope
+
+def lb_kim_batch(query, candidates):
+    """
+    Compute the LB_Kim lower bounding measure between a query and every candidate.
+
+    Parameters:
+    - query: the query time series
+    - candidates: the (N, L) matrix of candidate time series
+
+    Returns:
+    - The N LB_Kim lower bounds, as returned by lb_kim
+    """
+    query = np.asarray(query, dtype=float)
+    candidates = np.asarray(candidates, dtype=float)
+    features = np.stack([
+        (query[0] - candidates[:, 0]) ** 2,
+        (query[-1] - candidates[:, -1]) ** 2,
+        (query.min() - candidates.min(axis=1)) ** 2,
+        (query.max() - candidates.max(axis=1)) ** 2,
+    ])
+    return features.max(axis=0)
+
+def lb_yi_batch(query, candidates):
+    """
+    Compute the LB_Yi lower bounding measure between a query and every candidate.
+
+    Parameters:
+    - query: the query time series
+    - candidates: the (N, L) matrix of candidate time series
+
+    Returns:
+    - The N LB_Yi lower bounds
+    """
+    query = np.asarray(query, dtype=float)
+    candidates = np.asarray(candidates, dtype=float)
+    above = np.maximum(query[None, :] - candidates.max(axis=1)[:, None], 0)
+    below = np.maximum(candidates.min(axis=1)[:, None] - query[None, :], 0)
+    return np.sqrt(np.sum(above ** 2 + below ** 2, axis=1))
+
+def lb_keogh_batch(query, candidates, r):
+    """
+    Compute the LB_Keogh lower bound between a query and every candidate.
+
+    As in lb_keogh, the points of the query are compared against the envelope
+    of each candidate.
+
+    Parameters:
+    - query: the query time series
+    - candidates: the (N, L) matrix of candidate time series, with L = len(query)
+    - r: the window size
+
+    Returns:
+    - The N LB_Keogh lower bounds
+    """
+    query = np.asarray(query, dtype=float)
+    candidates = np.asarray(candidates, dtype=float)
+    if candidates.shape[1] != len(query):
+        raise ValueError("LB_Keogh requires the query and the candidates to have the same length")
+    upper, lower = compute_envelope(candidates, r)
+    above = np.maximum(query[None, :] - upper, 0)
+    below = np.maximum(lower - query[None, :], 0)
+    return np.sqrt(np.sum(above ** 2 + below ** 2, axis=1))
+
+def dtw_distance_batch(query, candidates, r=None, prefix_lengths=None):
+    """
+    Compute the DTW distance between a query and every candidate.
+
+    The recurrence is evaluated one anti-diagonal at a time: every cell (i, j) with
+    i + j = d only depends on the diagonals d - 1 and d - 2, so a whole diagonal of
+    every candidate is filled with a single vectorized update.
+
+    Since cell (l, l) holds the DTW distance between the prefixes of length l, the
+    distances for several prefix lengths can be read off a single pass.
+
+    Parameters:
+    - query: the query time series
+    - candidates: the (N, m) matrix of candidate time series
+    - r: the warping window (None for the unconstrained DTW)
+    - prefix_lengths: the prefix lengths to return the distances for, if any (the query
+      and the candidates must then have the same length)
+
+    Returns:
+    - The N DTW distances, equal to dtw_distance(query, candidate, r) for each row, or
+      the (N, len(prefix_lengths)) DTW distances between the prefixes if prefix_lengths
+    """
+    query = np.asarray(query, dtype=float)
+    candidates = np.asarray(candidates, dtype=float)
+    n, m = len(query), candidates.shape[1]
+    num_candidates = candidates.shape[0]
+    if r is None:
+        r = max(n, m)
+    r = max(r, abs(n - m))
+    if prefix_lengths is not None:
+        if n != m:
+            raise ValueError("Prefix distances require the query and the candidates to have the same length")
+        prefix_lengths = np.asarray(prefix_lengths, dtype=int)
+        if np.any(prefix_lengths < 1) or np.any(prefix_lengths > n):
+            raise ValueError(f"The prefix lengths must lie between 1 and {n}")
+        prefixes = np.empty((num_candidates, len(prefix_lengths)))
+        # the prefix lengths whose cell lies on each anti-diagonal
+        on_diagonal = {}
+        for column, length in enumerate(prefix_lengths):
+            on_diagonal.setdefault(2 * length, []).append((column, length))
+
+    # the last two diagonals and the one being filled, indexed by the row i
+    prev2 = np.full((num_candidates, n + 1), np.inf)
+    prev1 = np.full((num_candidates, n + 1), np.inf)
+    curr = np.empty((num_candidates, n + 1))
+    prev2[:, 0] = 0 # dp[0][0]
+    for d in range(2, n + m + 1):
+        curr.fill(np.inf)
+        lo = max(1, d - m, (d - r + 1) // 2)
+        hi = min(n, d - 1, (d + r) // 2)
+        if lo <= hi:
+            i = np.arange(lo, hi + 1)
+            cost = (query[i - 1] - candidates[:, d - i - 1]) ** 2
+            # dp[i-1][j], dp[i][j-1] and dp[i-1][j-1] respectively
+            best = np.minimum(prev1[:, lo - 1:hi], prev1[:, lo:hi + 1])
+            np.minimum(best, prev2[:, lo - 1:hi], out=best)
+            curr[:, lo:hi + 1] = cost + best
+        if prefix_lengths is not None:
+            for column, length in on_diagonal.get(d, ()):
+                prefixes[:, column] = curr[:, length] # dp[l][l]
+        prev2, prev1, curr = prev1, curr, prev2
+    if prefix_lengths is not None:
+        return np.sqrt(prefixes)
+    return np.sqrt(prev1[:, n])
@@ -0,0 +1,347 @@
+"""
+This file contains the benchmark harness measuring the index build time, the k-NN and range
+query latencies, the DTW calls per query and the peak memory over a sweep of settings.
+
+Usage:
+    python benchmark.py --sizes 1000 5000 --lengths 128 --paa-sizes 8 16 --windows 4 12 --output report.json
+    python benchmark.py --source sunspots --output current.csv --baseline report.json
+    python benchmark.py --source sunspots --data-path /data/Sunspots.csv --repeats 10
+
+Author:
+- Artur Dandolini Pescador
+"""
+
+import argparse
+import csv
+import functools
+import itertools
+import json
+import os
+import sys
+import time
+import tracemalloc
+import numpy as np
+from data_preprocessing import load_and_process_data, normalize_timeseries
+from indexed_structure import IndexedStructure
+from indexing import LowerBoundCascade, knn_search, range_search
+
+# the settings identifying a row of the report, and the metrics compared between reports
+KEYS = ('source', 'size', 'length', 'paa_size', 'r', 'k')
+METRICS = ('build_time', 'build_memory', 'knn_p50', 'knn_p99', 'knn_dtw_calls', 'range_p50', 'range_p99', 'range_dtw_calls', 'query_memory')
+TIMINGS = ('build_time', 'knn_p50', 'knn_p99', 'range_p50', 'range_p99')
+
+# the sunspot csv shipped next to this file
+SUNSPOTS_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'Sunspots.csv')
+
+def random_walks(num_series, length, seed=0):
+    """
+    Generate z-normalized random walks.
+
+    Parameters:
+    - num_series: the number of series
+    - length: the length of each series
+    - seed: the seed of the random generator
+
+    Returns:
+    - The (num_series, length) matrix of random walks
+    """
+    rng = np.random.default_rng(seed)
+    walks = np.cumsum(rng.standard_normal((num_series, length)), axis=1)
+    return z_normalize(walks)
+
+def sunspot_windows(num_series, length, seed=0, filepath=SUNSPOTS_PATH):
+    """
+    Cut z-normalized windows at random offsets of the monthly sunspot series.
+
+    Parameters:
+    - num_series: the number of windows
+    - length: the length of each window
+    - seed: the seed of the random generator
+    - filepath: the path of the sunspot csv file
+
+    Returns:
+    - The (num_series, length) matrix of windows
+    """
+    series = load_and_process_data(filepath).iloc[:, 0].to_numpy(dtype=float)
+    if length > len(series):
+        raise ValueError(f"The windows cannot be longer than the {len(series)} sunspot observations")
+    rng = np.random.default_rng(seed)
+    offsets = rng.integers(0, len(series) - length + 1, size=num_series)
+    return z_normalize(series[offsets[:, None] + np.arange(length)])
+
+def z_normalize(matrix):
+    """Z-normalize every row of a matrix, leaving constant rows centered."""
+    return normalize_timeseries(matrix, per_row=True, inplace=True)
+
+GENERATORS = {'random': random_walks, 'sunspots': sunspot_windows}
+
+def peak_memory(function, *args):
+    """
+    Run a function under tracemalloc.
+
+    Parameters:
+    - function: the function to run
+    - args: its arguments
+
+    Returns:
+    - The peak number of bytes allocated while it ran
+    """
+    tracemalloc.start()
+    try:
+        function(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def best_time(function, repeats, *args):
+    """
+    Time a function over several runs.
+
+    Parameters:
+    - function: the function to run
+    - repeats: the number of runs
+    - args: its arguments
+
+    Returns:
+    - The shortest running time in seconds, the least disturbed by the rest of the system
+    - The result of the last run
+    """
+    best = np.inf
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def time_queries(search, queries, repeats=5):
+    """
+    Time a search function over every query.
+
+    A first untimed pass over the queries warms the caches up, then every query is timed
+    over repeats runs and its shortest latency is kept.
+
+    Parameters:
+    - search: the function running the i-th query, returning the number of DTW calls it made
+    - queries: the query sequences
+    - repeats: the number of timed runs of each query
+
+    Returns:
+    - The latency of each query in seconds
+    - The number of DTW calls of each query
+    """
+    for i in range(len(queries)):
+        search(i)
+    latencies, dtw_calls = [], []
+    for i in range(len(queries)):
+        latency, calls = best_time(search, repeats, i)
+        latencies.append(latency)
+        dtw_calls.append(calls)
+    return np.array(latencies), np.array(dtw_calls)
+
+def run_case(dataset, queries, paa_size, r, k, max_entries=16, repeats=5):
+    """
+    Benchmark one setting on a database and a set of queries.
+
+    The range queries use the distance of the k-th neighbor of each query as epsilon, so
+    that they return k matches and stay comparable across datasets. Timings are taken
+    without tracemalloc, whose overhead would distort them, as the shortest of repeats
+    runs after a warm-up; the peak memory is measured on a separate build and a separate
+    k-NN query.
+
+    Parameters:
+    - dataset: the (N, L) matrix of database series
+    - queries: the (Q, L) matrix of query series
+    - paa_size: the PAA dimension of the index
+    - r: the warping window
+    - k: the number of neighbors
+    - max_entries: the node capacity of the index
+    - repeats: the number of timed runs of the build and of each query
+
+    Returns:
+    - A dictionary mapping each metric to its value
+    """
+    IndexedStructure.bulk_load(dataset, paa_size, max_entries)
+    build_time, index = best_time(IndexedStructure.bulk_load, repeats, dataset, paa_size, max_entries)
+    build_memory = peak_memory(IndexedStructure.bulk_load, dataset, paa_size, max_entries)
+
+    epsilons = np.zeros(len(queries))
+    def knn(i):
+        cascade = LowerBoundCascade(queries[i], r)
+        epsilons[i] = knn_search(index, queries[i], k, r, cascade)[-1][1]
+        return cascade.dtw_calls
+    def range_query(i):
+        cascade = LowerBoundCascade(queries[i], r)
+        range_search(index, queries[i], epsilons[i], r, cascade)
+        return cascade.dtw_calls
+
+    knn_latencies, knn_calls = time_queries(knn, queries, repeats)
+    range_latencies, range_calls = time_queries(range_query, queries, repeats)
+    return {
+        'build_time': build_time,
+        'build_memory': build_memory,
+        'knn_p50': np.percentile(knn_latencies, 50),
+        'knn_p99': np.percentile(knn_latencies, 99),
+        'knn_dtw_calls': knn_calls.mean(),
+        'range_p50': np.percentile(range_latencies, 50),
+        'range_p99': np.percentile(range_latencies, 99),
+        'range_dtw_calls': range_calls.mean(),
+        'query_memory': peak_memory(knn_search, index, queries[0], k, r),
+    }
+
+def run_sweep(source, sizes, lengths, paa_sizes, windows, ks, num_queries=20, seed=0, log=None, repeats=5, data_path=None):
+    """
+    Benchmark every combination of the given settings.
+
+    The database and the queries are generated once per (size, length), from different
+    seeds so that the queries are not in the database.
+
+    Parameters:
+    - source: the data generator, 'random' or 'sunspots'
+    - sizes: the database sizes
+    - lengths: the series lengths
+    - paa_sizes: the PAA dimensions
+    - windows: the warping windows
+    - ks: the numbers of neighbors
+    - num_queries: the number of queries per setting
+    - seed: the seed of the data generator
+    - log: the file the progress is printed to, if any
+    - repeats: the number of timed runs of the build and of each query
+    - data_path: the file the data is read from, for the sources read from a file
+
+    Returns:
+    - The rows of the report, one per setting
+    """
+    generate = GENERATORS[source]
+    if data_path is not None:
+        generate = functools.partial(generate, filepath=data_path)
+    rows = []
+    for size, length in itertools.product(sizes, lengths):
+        dataset = generate(size, length, seed)
+        queries = generate(num_queries, length, seed + 1)
+        for paa_size, r, k in itertools.product(paa_sizes, windows, ks):
+            if paa_size > length or k > size:
+                continue
+            row = dict(zip(KEYS, (source, size, length, paa_size, r, k)))
+            row.update({metric: float(value) for metric, value in run_case(dataset, queries, paa_size, r, k, repeats=repeats).items()})
+            rows.append(row)
+            if log is not None:
+                print(format_row(row), file=log, flush=True)
+    return rows
+
+def format_row(row):
+    """Format a row of the report as a single line."""
+    settings = ' '.join(f"{key}={row[key]}" for key in KEYS)
+    return (f"{settings}: build {row['build_time']:.3f}s, "
+            f"knn p50/p99 {row['knn_p50'] * 1e3:.1f}/{row['knn_p99'] * 1e3:.1f}ms ({row['knn_dtw_calls']:.1f} DTW), "
+            f"range p50/p99 {row['range_p50'] * 1e3:.1f}/{row['range_p99'] * 1e3:.1f}ms ({row['range_dtw_calls']:.1f} DTW), "
+            f"memory {row['build_memory'] / 2**20:.1f}/{row['query_memory'] / 2**20:.1f}MiB")
+
+def save_report(rows, path):
+    """
+    Write the rows of a report to a JSON or CSV file, depending on its extension.
+
+    Parameters:
+    - rows: the rows of the report
+    - path: the path of the report
+    """
+    if os.path.splitext(path)[1].lower() == '.csv':
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=KEYS + METRICS)
+            writer.writeheader()
+            writer.writerows(rows)
+    else:
+        with open(path, 'w') as f:
+            json.dump(rows, f, indent=2)
+
+def load_report(path):
+    """
+    Read the rows of a report written by save_report.
+
+    Parameters:
+    - path: the path of the report
+
+    Returns:
+    - The rows of the report
+    """
+    if os.path.splitext(path)[1].lower() != '.csv':
+        with open(path) as f:
+            return json.load(f)
+    with open(path, newline='') as f:
+        rows = list(csv.DictReader(f))
+    for row in rows:
+        for key in KEYS + METRICS:
+            if key != 'source':
+                row[key] = float(row[key]) if key in METRICS else int(row[key])
+    return rows
+
+def compare_reports(baseline, current, tolerance=0.1, time_tolerance=0.25, time_floor=1e-3):
+    """
+    Find the metrics that got worse between two reports.
+
+    The timings are noisier than the DTW calls and the memory, so they get their own
+    relative tolerance, and an absolute floor below which a slowdown is ignored.
+
+    Parameters:
+    - baseline: the rows of the reference report
+    - current: the rows of the new report
+    - tolerance: the relative increase of a count or memory metric tolerated before it is reported
+    - time_tolerance: the relative increase of a timing tolerated before it is reported
+    - time_floor: the increase of a timing, in seconds, tolerated whatever its relative size
+
+    Returns:
+    - The regressions, as (settings, metric, baseline value, current value) tuples
+    """
+    reference = {tuple(row[key] for key in KEYS): row for row in baseline}
+    regressions = []
+    for row in current:
+        settings = tuple(row[key] for key in KEYS)
+        if settings not in reference:
+            continue
+        for metric in METRICS:
+            before, after = reference[settings][metric], row[metric]
+            if metric in TIMINGS:
+                regressed = after > before * (1 + time_tolerance) and after - before > time_floor
+            else:
+                regressed = after > before * (1 + tolerance)
+            if regressed:
+                regressions.append((dict(zip(KEYS, settings)), metric, before, after))
+    return regressions
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the DTW index build, k-NN and range queries.")
+    parser.add_argument('--source', choices=sorted(GENERATORS), default='random')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 5000])
+    parser.add_argument('--lengths', type=int, nargs='+', default=[128])
+    parser.add_argument('--paa-sizes', type=int, nargs='+', default=[8, 16])
+    parser.add_argument('--windows', type=int, nargs='+', default=[4, 12])
+    parser.add_argument('--ks', type=int, nargs='+', default=[1, 10])
+    parser.add_argument('--queries', type=int, default=20, help="number of queries per setting")
+    parser.add_argument('--repeats', type=int, default=5, help="timed runs of the build and of each query, the shortest being kept")
+    parser.add_argument('--data-path', help="the csv file of the sunspots source (by default, the one next to this file)")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="the .json or .csv file the report is written to")
+    parser.add_argument('--baseline', help="a previous report to compare the results against")
+    parser.add_argument('--tolerance', type=float, default=0.1, help="relative increase of the DTW calls and memory tolerated by the comparison")
+    parser.add_argument('--time-tolerance', type=float, default=0.25, help="relative slowdown tolerated by the comparison")
+    parser.add_argument('--time-floor', type=float, default=1e-3, help="slowdown in seconds tolerated by the comparison whatever its relative size")
+    args = parser.parse_args(argv)
+    if args.data_path is not None and args.source != 'sunspots':
+        parser.error("--data-path only applies to the sunspots source")
+    if args.repeats < 1:
+        parser.error("--repeats must be at least 1")
+
+    rows = run_sweep(args.source, args.sizes, args.lengths, args.paa_sizes, args.windows, args.ks,
+                     args.queries, args.seed, log=sys.stdout, repeats=args.repeats, data_path=args.data_path)
+    if args.output:
+        save_report(rows, args.output)
+    if args.baseline:
+        regressions = compare_reports(load_report(args.baseline), rows, args.tolerance, args.time_tolerance, args.time_floor)
+        for settings, metric, before, after in regressions:
+            settings = ' '.join(f"{key}={value}" for key, value in settings.items())
+            print(f"REGRESSION {settings}: {metric} {before:.4g} -> {after:.4g}")
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
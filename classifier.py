@@ -0,0 +1,169 @@
+"""
+This file contains the implementation of the exact k-nearest neighbor classifier under the DTW distance.
+
+Author:
+- Artur Dandolini Pescador
+"""
+
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from dtw_functions import dtw_distance
+from envelope import Envelope, compute_envelope
+from indexing import KBest
+
+# training set shared with the worker processes of the classifier
+_worker_state = {}
+
+def _init_worker(train_features, upper, lower, r):
+    """Keep the training set and its envelopes in the worker process."""
+    _worker_state.update(train_features=train_features, upper=upper, lower=lower, r=r)
+
+def _nearest_neighbors(query, k):
+    """
+    Exact k nearest training series of a query.
+
+    Both LB_Keogh bounds (the training series against the query envelope, and the query
+    against the precomputed training envelopes) are computed for the whole training set
+    in one vectorized pass. The candidates are visited in increasing order of the tighter
+    one, until it reaches the k-th best distance; each DTW is abandoned at that distance
+    and seeded with the cumulative contributions of the tighter bound.
+    """
+    train_features, upper, lower, r = (_worker_state[key] for key in ('train_features', 'upper', 'lower', 'r'))
+    envelope = Envelope(query, r)
+    candidate_side = (np.maximum(train_features - envelope.upper, 0) + np.maximum(envelope.lower - train_features, 0)) ** 2
+    query_side = (np.maximum(query - upper, 0) + np.maximum(lower - query, 0)) ** 2
+    lb_candidate, lb_query = np.sqrt(candidate_side.sum(axis=1)), np.sqrt(query_side.sum(axis=1))
+    bounds = np.maximum(lb_candidate, lb_query)
+
+    result = KBest(k)
+    dtw_calls = 0
+    for index in np.argsort(bounds, kind='stable'):
+        kth_distance = result.kth_distance
+        if bounds[index] >= kth_distance:
+            break
+        contributions = candidate_side[index] if lb_candidate[index] >= lb_query[index] else query_side[index]
+        cb = np.append(np.cumsum(contributions[::-1])[::-1], 0).tolist()
+        distance = dtw_distance(query, train_features[index], r, kth_distance, cb)
+        dtw_calls += 1
+        result.push(distance, index)
+    neighbors = result.items()
+    return [int(index) for index, _ in neighbors], [distance for _, distance in neighbors], dtw_calls
+
+def _nearest_neighbors_chunk(queries, k):
+    return [_nearest_neighbors(query, k) for query in queries]
+
+class DTWNearestNeighborClassifier:
+    """
+    Exact k-nearest neighbor classifier under the banded DTW distance.
+
+    The envelopes of the training series are computed once by fit. Each test series then
+    only computes its own envelope, bounds every training series with LB_Keogh in one
+    vectorized pass, and runs early-abandoning DTW on the candidates in increasing order
+    of their bound, so that most of the N_test x N_train DTW distances are never computed.
+    The test series are spread over max_workers processes.
+
+    The neighbors vote for the label, ties going to the label of the nearest neighbor
+    among the tied ones. The number of DTW distances computed by the last call to
+    predict or kneighbors is kept in dtw_calls.
+    """
+    def __init__(self, r=None, n_neighbors=1, max_workers=None):
+        if n_neighbors < 1:
+            raise ValueError("n_neighbors must be at least 1")
+        self.r = r
+        self.n_neighbors = n_neighbors
+        self.max_workers = max_workers
+        self.train_features = None
+        self.train_labels = None
+        self.dtw_calls = 0
+
+    def fit(self, X, y):
+        """
+        Store the training set and compute the envelope of every training series.
+
+        Parameters:
+        - X: the (N, L) matrix of training time series
+        - y: the N labels
+
+        Returns:
+        - The classifier itself
+        """
+        self.train_features = np.ascontiguousarray(X, dtype=float)
+        self.train_labels = np.asarray(y)
+        if len(self.train_features) != len(self.train_labels):
+            raise ValueError("X and y must have the same number of rows")
+        if self.n_neighbors < 1:
+            raise ValueError("n_neighbors must be at least 1")
+        if len(self.train_features) < self.n_neighbors:
+            raise ValueError(f"At least {self.n_neighbors} training series are needed")
+        self.upper, self.lower = compute_envelope(self.train_features, self.r)
+        return self
+
+    def kneighbors(self, X):
+        """
+        Find the nearest training series of every test series.
+
+        Parameters:
+        - X: the (M, L) matrix of test time series
+
+        Returns:
+        - The (M, n_neighbors) DTW distances to the nearest training series, sorted
+        - The (M, n_neighbors) indices of these training series
+        """
+        if self.train_features is None:
+            raise ValueError("The classifier must be fitted before it is used")
+        X = np.asarray(X, dtype=float)
+        if X.ndim != 2 or X.shape[1] != self.train_features.shape[1]:
+            raise ValueError("The test series must have the length of the training series")
+        if len(X) == 0:
+            self.dtw_calls = 0
+            return np.empty((0, self.n_neighbors)), np.empty((0, self.n_neighbors), dtype=int)
+        state = (self.train_features, self.upper, self.lower, self.r)
+        if self.max_workers is None or self.max_workers <= 1:
+            _init_worker(*state)
+            try:
+                results = _nearest_neighbors_chunk(X, self.n_neighbors)
+            finally:
+                _worker_state.clear()
+        else:
+            chunks = np.array_split(np.arange(len(X)), min(len(X), self.max_workers * 4))
+            with ProcessPoolExecutor(self.max_workers, initializer=_init_worker, initargs=state) as executor:
+                futures = [executor.submit(_nearest_neighbors_chunk, X[chunk], self.n_neighbors) for chunk in chunks]
+            results = [result for future in futures for result in future.result()]
+
+        self.dtw_calls = sum(calls for _, _, calls in results)
+        indices = np.array([neighbors for neighbors, _, _ in results], dtype=int).reshape(len(X), self.n_neighbors)
+        distances = np.array([neighbor_distances for _, neighbor_distances, _ in results]).reshape(len(X), self.n_neighbors)
+        return distances, indices
+
+    def predict(self, X):
+        """
+        Predict the label of every test series.
+
+        Parameters:
+        - X: the (M, L) matrix of test time series
+
+        Returns:
+        - The M predicted labels
+        """
+        _, indices = self.kneighbors(X)
+        predictions = []
+        for neighbors in indices:
+            votes = Counter(self.train_labels[neighbors].tolist())
+            most = max(votes.values())
+            # the neighbors are sorted by distance: the first tied label is the nearest one
+            predictions.append(next(label for label in self.train_labels[neighbors].tolist() if votes[label] == most))
+        return np.array(predictions, dtype=self.train_labels.dtype)
+
+    def score(self, X, y):
+        """
+        Compute the accuracy of the classifier on a labelled test set.
+
+        Parameters:
+        - X: the (M, L) matrix of test time series
+        - y: the M true labels
+
+        Returns:
+        - The fraction of test series whose label is predicted correctly
+        """
+        return float(np.mean(self.predict(X) == np.asarray(y)))
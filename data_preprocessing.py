@@ -1,29 +1,203 @@
 """
 This file contains the functions to load and process the data.
 
+The text files can be converted once into .npy files kept in a cache directory, keyed by
+the path, size and modification time of the source, so that later runs open them as
+memory maps instead of parsing the text again. The conversion streams the text by
+chunks of rows, and iter_rows walks a matrix the same way, so that datasets larger than
+the memory can be loaded and normalized.
+
 Author:
 - Artur Dandolini Pescador
 """
 
+import glob
+import hashlib
+import itertools
 import numpy as np
 import pandas as pd
 import os
 
-def load_and_process_data(filepath):
+def cache_path(source, cache_dir, suffix):
+    """
+    Path of the cached .npy conversion of a source file.
+
+    Parameters:
+    - source: the path of the source file
+    - cache_dir: the cache directory
+    - suffix: what the conversion is (e.g. the dtype of the array)
+
+    Returns:
+    - The path of the .npy file, which changes whenever the source is modified
+    """
+    source_stat = os.stat(source)
+    prefix = f"{os.path.basename(source)}_{hashlib.sha1(os.path.abspath(source).encode()).hexdigest()[:8]}"
+    return os.path.join(cache_dir, f"{prefix}_{source_stat.st_size}_{source_stat.st_mtime_ns}_{suffix}.npy")
+
+def cached_load(source, cache_dir, suffix, convert, mmap_mode='r'):
+    """
+    Open the cached .npy conversion of a source file, converting it first if needed.
+
+    Parameters:
+    - source: the path of the source file
+    - cache_dir: the cache directory
+    - suffix: what the conversion is (e.g. the dtype of the array)
+    - convert: the function writing the conversion of source to the .npy path it is given
+    - mmap_mode: the mode of the memory map ('r', 'r+', 'c' for copy-on-write), or None to read it in memory
+
+    Returns:
+    - The converted array
+    """
+    path = cache_path(source, cache_dir, suffix)
+    if not os.path.exists(path):
+        os.makedirs(cache_dir, exist_ok=True)
+        # the conversions of previous versions of the source are stale
+        version = os.path.basename(path)[:-len(f"_{suffix}.npy")]
+        prefix = version.rsplit('_', 2)[0]
+        for stale in glob.glob(os.path.join(glob.escape(cache_dir), f"{glob.escape(prefix)}_*.npy")):
+            if not os.path.basename(stale).startswith(version + '_'):
+                os.remove(stale)
+        temporary = path + '.tmp'
+        convert(source, temporary)
+        os.replace(temporary, path) # an interrupted conversion never looks complete
+    return np.load(path, mmap_mode=mmap_mode)
+
+def text_to_npy(source, target, delimiter=',', dtype=np.float64, chunk_size=4096):
+    """
+    Convert a delimited text matrix to a .npy file, chunk_size rows at a time.
+
+    Parameters:
+    - source: the path of the text file, one row per line
+    - target: the path of the .npy file
+    - delimiter: the delimiter of the values of a row
+    - dtype: the dtype of the array
+    - chunk_size: the number of rows parsed at a time
+    """
+    with open(source) as file:
+        lines = (line for line in file if line.strip())
+        first = next(lines, None)
+        if first is None:
+            raise ValueError(f"{source} is empty")
+        rows = 1 + sum(1 for _ in lines)
+    columns = len(first.split(delimiter))
+
+    matrix = np.lib.format.open_memmap(target, mode='w+', dtype=dtype, shape=(rows, columns))
+    with open(source) as file:
+        lines = (line for line in file if line.strip())
+        start = 0
+        while start < rows:
+            chunk = np.loadtxt(list(itertools.islice(lines, chunk_size)), delimiter=delimiter, dtype=dtype, ndmin=2)
+            matrix[start:start + len(chunk)] = chunk
+            start += len(chunk)
+    matrix.flush()
+    del matrix
+
+def _sunspots_to_npy(source, target):
+    """Convert the dates and values of the sunspots CSV to a structured .npy file."""
+    data = pd.read_csv(source)
+    del data['Unnamed: 0']
+    dates = pd.to_datetime(data.pop('Date')).to_numpy()
+    records = np.empty(len(data), dtype=[('Date', dates.dtype)] + [(str(column), float) for column in data.columns])
+    records['Date'] = dates
+    for column in data.columns:
+        records[str(column)] = data[column].to_numpy(dtype=float)
+    with open(target, 'wb') as file:
+        np.save(file, records)
+
+def load_and_process_data(filepath, cache_dir=None):
+    """
+    Load the sunspots CSV as a time series indexed by date.
+
+    Parameters:
+    - filepath: the path of the CSV file
+    - cache_dir: the directory caching the parsed file, if any
+
+    Returns:
+    - The DataFrame of the values, indexed by date
+    """
+    if cache_dir is not None:
+        records = cached_load(filepath, cache_dir, 'records', _sunspots_to_npy, mmap_mode=None)
+        columns = [name for name in records.dtype.names if name != 'Date']
+        return pd.DataFrame({column: records[column] for column in columns},
+                            index=pd.DatetimeIndex(records['Date'], name='Date'))
+
     data = pd.read_csv(filepath)
     del data['Unnamed: 0']
     data['Date'] = pd.to_datetime(data['Date'])
     timeseries = data.set_index(data['Date'])
     del timeseries['Date']
     return timeseries
-    
-def load_data_UCR(data_dir, dataset_name):
+
+def load_data_UCR(data_dir, dataset_name, cache_dir=None, dtype=np.float64, mmap_mode='r'):
+    """
+    Load the train and test sets of a dataset of the UCR archive, the label being the first column.
+
+    Parameters:
+    - data_dir: the directory of the archive
+    - dataset_name: the name of the dataset
+    - cache_dir: the directory caching the converted files, if any (they are then opened as memory maps)
+    - dtype: the dtype of the matrices
+    - mmap_mode: the mode of the memory maps ('c' allows normalizing them in place without touching the cache)
+
+    Returns:
+    - The train matrix
+    - The test matrix
+    """
     data_dir = os.path.join(data_dir, dataset_name)
     train_file = os.path.join(data_dir, dataset_name + "_TRAIN")
     test_file = os.path.join(data_dir, dataset_name + "_TEST")
-    train_data = np.loadtxt(train_file, delimiter=',')
-    test_data = np.loadtxt(test_file, delimiter=',')
+    if cache_dir is not None:
+        def convert(source, target):
+            text_to_npy(source, target, dtype=dtype)
+        suffix = np.dtype(dtype).name
+        return (cached_load(train_file, cache_dir, suffix, convert, mmap_mode),
+                cached_load(test_file, cache_dir, suffix, convert, mmap_mode))
+    train_data = np.loadtxt(train_file, delimiter=',', dtype=dtype)
+    test_data = np.loadtxt(test_file, delimiter=',', dtype=dtype)
     return train_data, test_data
 
-def normalize_timeseries(timeseries):
-    return (timeseries - timeseries.mean()) / timeseries.std()
\ No newline at end of file
+def iter_rows(matrix, chunk_size=4096):
+    """
+    Iterate over a matrix by chunks of rows, reading only one chunk of a memory map at a time.
+
+    Parameters:
+    - matrix: the matrix (or memory map)
+    - chunk_size: the number of rows of a chunk
+
+    Returns:
+    - A generator of (first row index, chunk) pairs, the chunks being views of the matrix
+    """
+    for start in range(0, len(matrix), chunk_size):
+        yield start, matrix[start:start + chunk_size]
+
+def normalize_timeseries(timeseries, per_row=False, inplace=False, chunk_size=4096):
+    """
+    Z-normalize a time series, or every row of a matrix.
+
+    Parameters:
+    - timeseries: the time series (a DataFrame, Series or array), or the matrix of time series
+    - per_row: whether every row of the matrix is normalized on its own (constant rows are only centered)
+    - inplace: whether the array is overwritten instead of copied
+    - chunk_size: the number of rows normalized at a time by the per-row normalization
+
+    Returns:
+    - The normalized time series
+    """
+    if not per_row and not inplace:
+        return (timeseries - timeseries.mean()) / timeseries.std()
+
+    if not inplace:
+        timeseries = np.array(timeseries, dtype=float)
+    elif not isinstance(timeseries, np.ndarray) or not np.issubdtype(timeseries.dtype, np.floating):
+        raise ValueError("Only float arrays can be normalized in place")
+    if not per_row:
+        mean, std = timeseries.mean(), timeseries.std()
+        timeseries -= mean
+        timeseries /= std
+        return timeseries
+
+    for _, chunk in iter_rows(timeseries if timeseries.ndim > 1 else timeseries[None], chunk_size):
+        std = chunk.std(axis=-1, keepdims=True)
+        chunk -= chunk.mean(axis=-1, keepdims=True)
+        chunk /= np.where(std > 0, std, 1)
+    return timeseries
@@ -0,0 +1,256 @@
+"""
+This file contains the pairwise DTW distance matrix engine and the memoization of the DTW
+distances, keyed by a hash of the content of the series and the warping window.
+
+The cache has two tiers: an in-memory LRU of single distances, and a directory of .npy
+distance matrices (condensed, i.e. the upper triangle only, for the symmetric ones), so
+that repeated analyses over the same dataset only cost lookups after the first run.
+
+Author:
+- Artur Dandolini Pescador
+"""
+
+import hashlib
+import os
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from batch_functions import dtw_distance_batch
+from dtw_functions import dtw_distance
+import numpy as np
+
+# arrays shared with the worker processes of dtw_matrix
+_worker_arrays = {}
+
+def _init_worker(queries, dataset):
+    """Keep the arrays of dtw_matrix in the worker process."""
+    _worker_arrays['queries'] = queries
+    _worker_arrays['dataset'] = dataset
+
+def _dtw_row(i, r, prefix_lengths, symmetric):
+    """DTW distances of the i-th query against the dataset (only the following rows if symmetric)."""
+    queries, dataset = _worker_arrays['queries'], _worker_arrays['dataset']
+    candidates = dataset[i + 1:] if symmetric else dataset
+    return dtw_distance_batch(queries[i], candidates, r, prefix_lengths)
+
+def _dtw_rows(rows, r, prefix_lengths, symmetric):
+    return [_dtw_row(i, r, prefix_lengths, symmetric) for i in rows]
+
+def series_key(time_series):
+    """
+    Hash the content of a time series.
+
+    Parameters:
+    - time_series: the time series, or a matrix with one series per row
+
+    Returns:
+    - The hexadecimal digest identifying the series (its length, dtype aside, included)
+    """
+    time_series = np.ascontiguousarray(time_series, dtype=float)
+    digest = hashlib.sha1(repr(time_series.shape).encode())
+    digest.update(time_series.tobytes())
+    return digest.hexdigest()
+
+def condense(matrix):
+    """Keep the upper triangle of a symmetric distance matrix, row by row."""
+    return matrix[np.triu_indices(len(matrix), 1)]
+
+def uncondense(condensed):
+    """Rebuild the symmetric distance matrix, with a zero diagonal, from its upper triangle."""
+    n = int(round((1 + np.sqrt(1 + 8 * len(condensed))) / 2))
+    matrix = np.zeros((n, n))
+    matrix[np.triu_indices(n, 1)] = condensed
+    return matrix + matrix.T
+
+def dtw_matrix(queries, dataset=None, r=3, prefix_lengths=None, max_workers=None):
+    """
+    Compute the DTW distance between every query and every series of a dataset.
+
+    Without a dataset, the pairwise distances between the queries are computed, each pair
+    once. With prefix_lengths, the distances between the prefixes of every length are
+    read off the same dynamic programming pass.
+
+    Parameters:
+    - queries: the (Q, L) matrix of query sequences
+    - dataset: the (N, L) matrix of dataset sequences, or None for the pairwise distances of the queries
+    - r: the warping window
+    - prefix_lengths: the prefix lengths to compute the distances for, if any
+    - max_workers: the number of worker processes (None or 1 computes everything in this process)
+
+    Returns:
+    - The (Q, N) distance matrix, or the (len(prefix_lengths), Q, N) stack of matrices if prefix_lengths
+    """
+    queries = np.ascontiguousarray(queries, dtype=float)
+    symmetric = dataset is None
+    dataset = queries if symmetric else np.ascontiguousarray(dataset, dtype=float)
+    if prefix_lengths is not None:
+        prefix_lengths = [int(length) for length in prefix_lengths]
+
+    rows = range(len(queries))
+    if max_workers is None or max_workers <= 1:
+        _init_worker(queries, dataset)
+        try:
+            results = _dtw_rows(rows, r, prefix_lengths, symmetric)
+        finally:
+            _worker_arrays.clear()
+    else:
+        # interleave the rows so that the short rows of the triangle are spread evenly
+        chunks = [rows[start::max_workers * 4] for start in range(max_workers * 4)]
+        with ProcessPoolExecutor(max_workers, initializer=_init_worker, initargs=(queries, dataset)) as executor:
+            futures = [executor.submit(_dtw_rows, chunk, r, prefix_lengths, symmetric) for chunk in chunks]
+        results = [None] * len(queries)
+        for chunk, future in zip(chunks, futures):
+            for i, row in zip(chunk, future.result()):
+                results[i] = row
+
+    distances = np.zeros((len(queries), len(dataset)) + (() if prefix_lengths is None else (len(prefix_lengths),)))
+    for i, row in enumerate(results):
+        if symmetric:
+            distances[i, i + 1:] = row
+            distances[i + 1:, i] = row
+        else:
+            distances[i] = row
+    if prefix_lengths is not None:
+        distances = np.moveaxis(distances, -1, 0)
+    return distances
+
+class DTWCache:
+    """
+    Memoized DTW distances.
+
+    Single distances are kept in an LRU of at most maxsize pairs, keyed by the content
+    hashes of both series and the window (in either order, DTW being symmetric). Whole
+    matrices are kept in memory and stored as .npy files in cache_dir, if given; they
+    also answer the single distance lookups between their rows and columns.
+    """
+    def __init__(self, maxsize=100000, cache_dir=None):
+        self.maxsize = maxsize
+        self.cache_dir = cache_dir
+        self._distances = OrderedDict()
+        self._matrices = {} # name -> (r, row index by key, column index by key, distances)
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._distances)
+
+    def clear(self):
+        """Empty the in-memory tiers, leaving the files of cache_dir untouched."""
+        self._distances.clear()
+        self._matrices.clear()
+
+    def pair_key(self, key1, key2, r):
+        """Key of the distance between two series given by their content hashes."""
+        return (min(key1, key2), max(key1, key2), r)
+
+    def lookup(self, key1, key2, r):
+        """Return the cached distance between two series given by their content hashes, or None."""
+        pair = self.pair_key(key1, key2, r)
+        if pair in self._distances:
+            self._distances.move_to_end(pair)
+            return self._distances[pair]
+        for matrix_r, rows, columns, matrix in self._matrices.values():
+            if matrix_r != r or rows is None:
+                continue
+            if key1 in rows and key2 in columns:
+                return matrix[rows[key1], columns[key2]]
+            if key2 in rows and key1 in columns:
+                return matrix[rows[key2], columns[key1]]
+        return None
+
+    def store(self, key1, key2, r, distance):
+        """Cache the distance between two series given by their content hashes."""
+        self._distances[self.pair_key(key1, key2, r)] = distance
+        self._distances.move_to_end(self.pair_key(key1, key2, r))
+        while len(self._distances) > self.maxsize:
+            self._distances.popitem(last=False)
+
+    def distance(self, s1, s2, r=None):
+        """
+        Compute the DTW distance between two time series, or look it up.
+
+        Parameters:
+        - s1: the first time series
+        - s2: the second time series
+        - r: the warping window (None for the unconstrained DTW)
+
+        Returns:
+        - The DTW distance between s1 and s2
+        """
+        key1, key2 = series_key(s1), series_key(s2)
+        distance = self.lookup(key1, key2, r)
+        if distance is not None:
+            self.hits += 1
+            return distance
+        self.misses += 1
+        distance = dtw_distance(s1, s2, r)
+        self.store(key1, key2, r, distance)
+        return distance
+
+    def matrix(self, queries, dataset=None, r=3, prefix_lengths=None, max_workers=None):
+        """
+        Compute the DTW distance matrix between queries and a dataset, or load it from cache_dir.
+
+        Parameters:
+        - queries: the (Q, L) matrix of query sequences
+        - dataset: the (N, L) matrix of dataset sequences, or None for the pairwise distances of the queries
+        - r: the warping window
+        - prefix_lengths: the prefix lengths to compute the distances for, if any
+        - max_workers: the number of worker processes computing the distances
+
+        Returns:
+        - The distance matrix, as returned by dtw_matrix
+        """
+        queries = np.asarray(queries, dtype=float)
+        symmetric = dataset is None
+        if prefix_lengths is not None:
+            prefix_lengths = [int(length) for length in prefix_lengths]
+        name = f"{series_key(queries)}_{'sym' if symmetric else series_key(dataset)}_{r}"
+        if prefix_lengths is not None:
+            name += '_' + hashlib.sha1(repr(prefix_lengths).encode()).hexdigest()[:16]
+        path = os.path.join(self.cache_dir, f"dtw_{name}.npy") if self.cache_dir is not None else None
+
+        if name in self._matrices:
+            self.hits += 1
+            return self._matrices[name][3]
+        if path is not None and os.path.exists(path):
+            self.hits += 1
+            stored = np.load(path)
+            if not symmetric:
+                distances = stored
+            elif prefix_lengths is None:
+                distances = uncondense(stored)
+            else:
+                distances = np.stack([uncondense(condensed) for condensed in stored])
+        else:
+            self.misses += 1
+            distances = dtw_matrix(queries, dataset, r, prefix_lengths, max_workers)
+            if path is not None:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                if not symmetric:
+                    stored = distances
+                elif prefix_lengths is None:
+                    stored = condense(distances)
+                else:
+                    stored = np.stack([condense(matrix) for matrix in distances])
+                np.save(path, stored)
+
+        rows = columns = None
+        if prefix_lengths is None:
+            rows = {series_key(sequence): i for i, sequence in enumerate(queries)}
+            columns = rows if symmetric else {series_key(sequence): j for j, sequence in enumerate(dataset)}
+        self._matrices[name] = (r, rows, columns, distances)
+        return distances
+
+    def pairwise(self, dataset, r=3, max_workers=None):
+        """
+        Compute the symmetric DTW distance matrix of a dataset, or load it from cache_dir.
+
+        Parameters:
+        - dataset: the (N, L) matrix of time series
+        - r: the warping window
+        - max_workers: the number of worker processes computing the distances
+
+        Returns:
+        - The (N, N) DTW distance matrix
+        """
+        return self.matrix(dataset, r=r, max_workers=max_workers)
@@ -6,30 +6,118 @@ Author:
 """
 
 import numpy as np
+from envelope import Envelope
+import paa_functions
 
-def dtw_distance(s1, s2):
+def dtw_distance(s1, s2, r=None, best_so_far=np.inf, cb=None, stats=None):
     """
     Compute the Dynamic Time Warping distance between two time series.
 
+    The warping path is constrained to a Sakoe-Chiba band of half-width r, so only
+    the cells with |i - j| <= r are evaluated. Only two rows of the band are kept in
+    memory, and the computation is abandoned as soon as every cell of a row exceeds
+    best_so_far, since no warping path can then end below it.
+
+    When cb is given, cb[k] must lower bound the squared cost still to be paid for the
+    points from index k onwards (e.g. the cumulative LB_Keogh contributions), which
+    lets the computation be abandoned rows earlier.
+
     Parameters:
     - s1: the first time series
     - s2: the second time series
+    - r: the warping window (None for the unconstrained DTW)
+    - best_so_far: the distance above which the computation is abandoned
+    - cb: the cumulative lower bound residuals, of length len(s2) + 1 with cb[-1] = 0
+    - stats: the SearchStats whose dtw_cells and abandoned_cells counters are updated, if any
 
     Returns:
-    - The DTW distance between s1 and s2
-    """
-    n, m = len(s1), len(s2)
-    dp = np.zeros((n+1, m+1))
-    for i in range(1, n+1):
-        dp[i][0] = np.inf
-    for i in range(1, m+1):
-        dp[0][i] = np.inf
-    dp[0][0] = 0
-    for i in range(1, n+1):
-        for j in range(1, m+1):
-            cost = (s1[i-1] - s2[j-1]) ** 2 # euclidean distance
-            dp[i][j] = cost + min(dp[i-1][j], dp[i][j-1], dp[i-1][j-1])
-    return np.sqrt(dp[n][m])
+    - The DTW distance between s1 and s2, or np.inf if it exceeds best_so_far
+    """
+    s1 = np.asarray(s1, dtype=float).tolist()
+    s2 = np.asarray(s2, dtype=float).tolist()
+
+    def row_costs(i, lo, hi):
+        x = s1[i - 1]
+        return [(x - y) ** 2 for y in s2[lo - 1:hi]] # euclidean distance
+
+    return dtw_band(len(s1), len(s2), row_costs, r, best_so_far, cb, stats)
+
+def dtw_band(n, m, row_costs, r=None, best_so_far=np.inf, cb=None, stats=None):
+    """
+    Run the banded, early-abandoning DTW recurrence over precomputed cell costs.
+
+    This is the kernel of dtw_distance and of the multivariate DTW distances, which only
+    differ by the cost of matching two points.
+
+    Parameters:
+    - n: the length of the first time series
+    - m: the length of the second time series
+    - row_costs: the function giving, for row i, the list of the costs of the cells (i, lo) to (i, hi)
+    - r: the warping window (None for the unconstrained DTW)
+    - best_so_far: the distance above which the computation is abandoned
+    - cb: the cumulative lower bound residuals, of length m + 1 with cb[-1] = 0
+    - stats: the SearchStats whose dtw_cells and abandoned_cells counters are updated, if any
+
+    Returns:
+    - The square root of the cost of the best warping path, or np.inf if it exceeds best_so_far
+    """
+    if r is None:
+        r = max(n, m)
+    r = max(r, abs(n - m)) # the band must contain the end cell (n, m)
+    # with some slack for the rounding of the square, the end cell deciding exactly
+    cutoff = best_so_far ** 2 * (1 + 1e-12)
+    inf = np.inf
+
+    # cell (i, j) of the band lives at position j - i + r + 1 of its row, the
+    # extra position at each end being an infinite sentinel
+    width = 2 * r + 3
+    prev = [inf] * width
+    prev[r + 1] = 0 # dp[0][0]
+    for i in range(1, n + 1):
+        curr = [inf] * width
+        lo, hi = max(1, i - r), min(m, i + r)
+        row_min = inf
+        k = lo - i + r + 1
+        for cost in row_costs(i, lo, hi):
+            # dp[i-1][j-1], dp[i-1][j] and dp[i][j-1] respectively
+            best = prev[k]
+            if prev[k + 1] < best:
+                best = prev[k + 1]
+            if curr[k - 1] < best:
+                best = curr[k - 1]
+            curr[k] = cost + best
+            if curr[k] < row_min:
+                row_min = curr[k]
+            k += 1
+        # the points after i + r are not reached yet by any path through row i
+        if row_min + (cb[hi] if cb is not None else 0) > cutoff:
+            if stats is not None:
+                computed = band_cells(n, m, r, i)
+                stats.dtw_cells += computed
+                stats.abandoned_cells += band_cells(n, m, r) - computed
+            return np.inf
+        prev = curr
+    if stats is not None:
+        stats.dtw_cells += band_cells(n, m, r)
+    # every row may stay under the cutoff while the end cell goes over it
+    distance = np.sqrt(prev[m - n + r + 1])
+    return distance if distance <= best_so_far else np.inf
+
+def band_cells(n, m, r, rows=None):
+    """
+    Count the cells of a Sakoe-Chiba band.
+
+    Parameters:
+    - n: the length of the first time series
+    - m: the length of the second time series
+    - r: the half-width of the band
+    - rows: the number of rows counted, from the first (None for all n)
+
+    Returns:
+    - The number of cells (i, j) with |i - j| <= r in the first rows of the n x m matrix
+    """
+    i = np.arange(1, (n if rows is None else rows) + 1)
+    return int(np.maximum(np.minimum(m, i + r) - np.maximum(1, i - r) + 1, 0).sum())
 
 def lb_kim(s1, s2):
     """
@@ -49,6 +137,26 @@ def lb_kim(s1, s2):
     lb = max((start1 - start2)**2, (end1 - end2)**2, (min1 - min2)**2, (max1 - max2)**2)
     return lb
 
+def lb_kim_fl(s1, s2):
+    """
+    Compute the O(1) LB_Kim lower bound using only the first and last points.
+
+    Every warping path matches the first points together and the last points together,
+    so, unlike lb_kim, this bound is in the same unit as the DTW distance.
+
+    Parameters:
+    - s1: the first time series
+    - s2: the second time series
+
+    Returns:
+    - The first/last LB_Kim lower bound between s1 and s2
+    """
+    first, last = (s1[0] - s2[0]) ** 2, (s1[-1] - s2[-1]) ** 2
+    if len(s1) == 1 or len(s2) == 1:
+        # the first and last cells of the path may coincide
+        return np.sqrt(max(first, last))
+    return np.sqrt(first + last)
+
 def lb_yi(s1, s2):
     """
     Compute the LB_YI lower bounding measure between two time series.
@@ -71,7 +179,7 @@ def lb_yi(s1, s2):
             lb_sum += (min2 - point)**2
     return np.sqrt(lb_sum)
 
-def lb_keogh(s1, s2, r):
+def lb_keogh(s1, s2, r, envelope=None):
     """
     Calculate the LB_Keogh lower bound between two time series.
 
@@ -79,24 +187,34 @@ def lb_keogh(s1, s2, r):
     - s1: the first time series
     - s2: the second time series
     - r: the window size
+    - envelope: the Envelope of s2, if already computed
     
     Returns:
     - The LB_Keogh lower bound between s1 and s2
     """
-    s1 = np.array(s1)
-    s2 = np.array(s2)
-    
-    LB_sum = 0
-    for ind, i in enumerate(s1):
-        lower_bound = np.min(s2[(max(0, ind - r)):(min(len(s2), ind + r + 1))])
-        upper_bound = np.max(s2[(max(0, ind - r)):(min(len(s2), ind + r + 1))])
+    s1 = np.asarray(s1, dtype=float)
+    if envelope is None:
+        envelope = Envelope(s2, r)
+    if len(s1) > len(envelope):
+        raise ValueError("LB_Keogh requires s1 to be no longer than s2")
+    return lb_keogh_envelope(s1, envelope.upper[:len(s1)], envelope.lower[:len(s1)])[0]
+
+def lb_keogh_envelope(C, U, L):
+    """
+    Calculate the LB_Keogh lower bound between a candidate and a precomputed envelope.
 
-        if i > upper_bound:
-            LB_sum = LB_sum + (i - upper_bound)**2
-        elif i < lower_bound:
-            LB_sum = LB_sum + (i - lower_bound)**2
+    Parameters:
+    - C: the candidate time series
+    - U: the upper envelope of the query
+    - L: the lower envelope of the query
 
-    return np.sqrt(LB_sum)
+    Returns:
+    - The LB_Keogh lower bound between the query and C
+    - The squared contribution of each point of C to the bound
+    """
+    C = np.asarray(C, dtype=float)
+    contributions = (np.maximum(C - U, 0) + np.maximum(L - C, 0)) ** 2
+    return np.sqrt(np.sum(contributions)), contributions
 
 def paa(time_series, dims):
     """
@@ -107,55 +225,30 @@ def paa(time_series, dims):
     - dims: the number of dimensions
 
     Returns:
-    - The PAA representation of the time series
+    - The PAA representation of the time series, each segment mean repeated over its segment
     """
-    length = len(time_series)
-    segment_length = length / dims
-    
-    # Initialize an array to hold the PAA representation
-    paa_representation = []
-    
-    for i in range(dims):
-        start_index = int(i * segment_length)
-        end_index = int((i + 1) * segment_length)
-        
-        # If we're at the last segment and we have a remainder, include it
-        if i == dims - 1 and end_index < length:
-            end_index = length
-        
-        # Calculate the mean for the segment
-        segment_mean = np.mean(time_series[start_index:end_index])
-        
-        # If not the last segment, append the mean value segment_length times
-        if i != dims - 1:
-            paa_representation += [segment_mean] * (end_index - start_index)
-        else:
-            # On the last segment, ensure we cover the remainder of the series
-            paa_representation += [segment_mean] * (length - start_index)
-    
-    return np.array(paa_representation)
+    return paa_functions.paa(time_series, dims, expand=True)
 
-def lb_paa(C_bar, U_hat, L_hat):
+def lb_paa(C_bar, U_hat, L_hat, weights=None):
     """
     Calculate the LB_PAA lower bounding measure between a query and a candidate time series in PAA representation.
 
     Parameters:
-    - C_bar: the candidate time series in PAA representation
+    - C_bar: the candidate time series in PAA representation, or a matrix with one candidate per row
     - U_hat: the upper bound in PAA representation
     - L_hat: the lower bound in PAA representation
+    - weights: the number of points of each PAA segment (the n/N factor), or None to leave the terms unweighted
 
     Returns:
     - The LB_PAA lower bound between the query and the candidate time series
     """
-    LB_sum = 0
-    for i in range(len(C_bar)):
-        if C_bar[i] > U_hat[i]:
-            LB_sum += (C_bar[i] - U_hat[i])**2
-        elif C_bar[i] < L_hat[i]:
-            LB_sum += (C_bar[i] - L_hat[i])**2
-    return np.sqrt(LB_sum)
+    C_bar = np.asarray(C_bar, dtype=float)
+    gap = np.maximum(C_bar - U_hat, 0) + np.maximum(L_hat - C_bar, 0)
+    if weights is not None:
+        return np.sqrt(np.sum(weights * gap ** 2, axis=-1))
+    return np.sqrt(np.sum(gap ** 2, axis=-1))
 
-def create_paa_bounds(timeSeries, r, dim):
+def create_paa_bounds(timeSeries, r, dim, envelope=None, expand=True):
     """
     Create the Piecewise Aggregate Approximation bounds for a time series.
 
@@ -163,37 +256,56 @@ def create_paa_bounds(timeSeries, r, dim):
     - timeSeries: the time series
     - r: the window size
     - dim: the number of dimensions
+    - envelope: the Envelope of timeSeries, if already computed
+    - expand: whether to return the bounds step-expanded to the length of the series
+      (as plotted) or with dim values (as used by lb_paa and mindist)
 
     Returns:
     - The upper and lower bounds in PAA representation
     """
-    U = [max(timeSeries[max(i-r, 0):min(i+r+1, len(timeSeries))]) for i in range(len(timeSeries))]
-    L = [min(timeSeries[max(i-r, 0):min(i+r+1, len(timeSeries))]) for i in range(len(timeSeries))]
-    U_hat = paa(U, dim)
-    L_hat = paa(L, dim)
+    if envelope is None:
+        envelope = Envelope(timeSeries, r)
+    U_hat, L_hat = envelope.paa_bounds(dim)
+    if expand:
+        _, lengths = paa_functions.segment_bounds(len(envelope), dim)
+        return np.repeat(U_hat, lengths), np.repeat(L_hat, lengths)
     return U_hat, L_hat
 
-def mindist(Q, MBR):
+def mindist(U_hat, L_hat, MBR, weights=None):
     """
     Calculate the minimum distance between a query and a Minimum Bounding Rectangle (MBR).
 
+    The query is the region [L_hat, U_hat] spanned by its PAA bounds (a point query
+    being given as U_hat = L_hat), so the distance lower bounds LB_PAA, and hence the
+    DTW distance, of every series whose PAA point lies inside the MBR.
+
     Parameters:
-    - Q: the query point
-    - MBR: the Minimum Bounding Rectangle
+    - U_hat: the upper bound of the query in PAA representation
+    - L_hat: the lower bound of the query in PAA representation
+    - MBR: the Minimum Bounding Rectangle, as (low, high) pairs, or a stack of MBRs
+    - weights: the number of points of each PAA segment (the n/N factor), or None to leave the terms unweighted
 
     Returns:
     - The minimum distance between the query and the MBR
     """
-    # I'm assuming a siple MBR where each dimension has the same fixed width
-    # mbr_width = 0.5
-    # return [(paa - mbr_width, paa + mbr_width) for paa in paa_representation]
-    mindist = 0
-    for i in range(len(Q)):
-        if Q[i] > MBR[i][1]:
-            mindist += (Q[i] - MBR[i][1])**2
-        elif Q[i] < MBR[i][0]:
-            mindist += (MBR[i][0] - Q[i])**2
-    return np.sqrt(mindist)
+    MBR = np.asarray(MBR, dtype=float)
+    return mindist_bounds(U_hat, L_hat, MBR[..., 0], MBR[..., 1], weights)
 
+def mindist_bounds(U_hat, L_hat, lows, highs, weights=None):
+    """
+    Calculate mindist for MBRs given as separate arrays of lows and highs.
 
+    Parameters:
+    - U_hat: the upper bound of the query in PAA representation
+    - L_hat: the lower bound of the query in PAA representation
+    - lows: the lower corners of the MBRs, one row each
+    - highs: the upper corners of the MBRs, one row each
+    - weights: the number of points of each PAA segment, or None to leave the terms unweighted
 
+    Returns:
+    - The minimum distance between the query and each MBR
+    """
+    gap = np.maximum(lows - U_hat, 0) + np.maximum(L_hat - highs, 0)
+    if weights is not None:
+        return np.sqrt(np.sum(weights * gap ** 2, axis=-1))
+    return np.sqrt(np.sum(gap ** 2, axis=-1))
@@ -0,0 +1,140 @@
+"""
+This file contains the computation of the upper and lower envelopes used by LB_Keogh and LB_PAA.
+
+Author:
+- Artur Dandolini Pescador
+"""
+
+from collections import deque
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from paa_functions import paa, channel_paa
+
+# above this window width (2r + 1) the O(n) deque beats the O(n * r) vectorized scan
+LEMIRE_MIN_WIDTH = 4096
+
+def lemire_envelope(time_series, r):
+    """
+    Compute the envelope of a time series with Lemire's streaming min/max algorithm.
+
+    Two monotone deques hold the indices of the candidate maxima and minima of the
+    current window, so every point is pushed and popped at most once: O(n) whatever r.
+
+    Parameters:
+    - time_series: the time series
+    - r: the window size
+
+    Returns:
+    - The upper and lower envelopes
+    """
+    values = np.asarray(time_series, dtype=float).tolist()
+    n = len(values)
+    upper, lower = np.empty(n), np.empty(n)
+    maxima, minima = deque(), deque()
+    for j in range(n + r):
+        if j < n:
+            while maxima and values[maxima[-1]] <= values[j]:
+                maxima.pop()
+            maxima.append(j)
+            while minima and values[minima[-1]] >= values[j]:
+                minima.pop()
+            minima.append(j)
+        i = j - r # the window of i is now complete
+        if i >= 0:
+            while maxima[0] < i - r:
+                maxima.popleft()
+            while minima[0] < i - r:
+                minima.popleft()
+            upper[i] = values[maxima[0]]
+            lower[i] = values[minima[0]]
+    return upper, lower
+
+def sliding_envelope(time_series, r):
+    """
+    Compute the envelope of a time series, or of every row of a matrix, with a vectorized scan.
+
+    Parameters:
+    - time_series: the time series, or an (N, L) matrix of time series
+    - r: the window size
+
+    Returns:
+    - The upper and lower envelopes, with the shape of time_series
+    """
+    time_series = np.asarray(time_series, dtype=float)
+    pad_width = [(0, 0)] * (time_series.ndim - 1) + [(r, r)]
+    upper = sliding_window_view(np.pad(time_series, pad_width, constant_values=-np.inf), 2 * r + 1, axis=-1).max(axis=-1)
+    lower = sliding_window_view(np.pad(time_series, pad_width, constant_values=np.inf), 2 * r + 1, axis=-1).min(axis=-1)
+    return upper, lower
+
+def compute_envelope(time_series, r):
+    """
+    Compute the envelope U_i = max(q_{i-r} : q_{i+r}), L_i = min(q_{i-r} : q_{i+r}).
+
+    Parameters:
+    - time_series: the time series, or an (N, L) matrix of time series
+    - r: the window size (None for a window covering the whole series)
+
+    Returns:
+    - The upper and lower envelopes, with the shape of time_series
+    """
+    time_series = np.asarray(time_series, dtype=float)
+    length = time_series.shape[-1]
+    r = length - 1 if r is None else min(r, length - 1)
+    if time_series.ndim == 1 and 2 * r + 1 > LEMIRE_MIN_WIDTH:
+        return lemire_envelope(time_series, r)
+    return sliding_envelope(time_series, r)
+
+def compute_channel_envelopes(time_series, r):
+    """
+    Compute the envelope of every channel of a multivariate time series.
+
+    Parameters:
+    - time_series: the (L, C) multivariate time series, or an (N, L, C) stack of them
+    - r: the window size (None for a window covering the whole series)
+
+    Returns:
+    - The upper and lower envelopes, with the shape of time_series
+    """
+    upper, lower = compute_envelope(np.swapaxes(np.asarray(time_series, dtype=float), -1, -2), r)
+    return np.swapaxes(upper, -1, -2), np.swapaxes(lower, -1, -2)
+
+class Envelope:
+    """
+    Envelope of a query, computed once and shared by every lower bound of a search.
+
+    The PAA of the upper and lower envelopes are cached per number of dimensions.
+    """
+    def __init__(self, time_series, r):
+        self.r = r
+        self.upper, self.lower = compute_envelope(time_series, r)
+        self._paa_bounds = {}
+
+    def __len__(self):
+        return len(self.upper)
+
+    def paa_bounds(self, dims):
+        """PAA of the upper and lower envelopes (U_hat, L_hat), with dims values each."""
+        if dims not in self._paa_bounds:
+            self._paa_bounds[dims] = (paa(self.upper, dims), paa(self.lower, dims))
+        return self._paa_bounds[dims]
+
+class MultivariateEnvelope(Envelope):
+    """
+    Envelope of a (L, C) multivariate query, one envelope per channel.
+
+    The PAA bounds are those of every channel concatenated, as indexed by a
+    MultivariateIndexedStructure.
+    """
+    def __init__(self, time_series, r):
+        self.r = r
+        self.upper, self.lower = compute_channel_envelopes(time_series, r)
+        self._paa_bounds = {}
+
+    def paa_bounds(self, dims):
+        """PAA of the upper and lower envelopes of every channel, dims values in total."""
+        channels = self.upper.shape[1]
+        if dims % channels:
+            raise ValueError(f"{dims} PAA dimensions cannot be split evenly over {channels} channels")
+        if dims not in self._paa_bounds:
+            self._paa_bounds[dims] = (channel_paa(self.upper, dims // channels), channel_paa(self.lower, dims // channels))
+        return self._paa_bounds[dims]
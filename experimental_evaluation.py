@@ -1,14 +1,65 @@
 """
 This file contains the implementation of the experimental evaluation of the lower bounding functions (T and P).
 
+The DTW distances are computed once per pair by the distance matrix engine of dtw_cache,
+which can spread the rows over worker processes; given a DTWCache, T and P share the
+matrices across calls and runs.
+
 Author:
 - Artur Dandolini Pescador
 """
 
-from dtw_functions import dtw_distance, lb_keogh, lb_yi, lb_kim
+from batch_functions import lb_keogh_batch, lb_yi_batch, lb_kim_batch
+from dtw_cache import dtw_matrix
 import numpy as np
 
-def compute_T(dataset):
+def true_distances(queries, dataset=None, r=3, prefix_lengths=None, max_workers=None, cache=None):
+    """DTW distance matrix from the DTWCache if given, as computed by dtw_matrix otherwise."""
+    if cache is None:
+        return dtw_matrix(queries, dataset, r, prefix_lengths, max_workers)
+    return cache.matrix(queries, dataset, r, prefix_lengths, max_workers)
+
+def lower_bound_matrices(queries, dataset, r=3):
+    """
+    Compute the LB_Yi, LB_Kim and LB_Keogh lower bounds between every query and every series of a dataset.
+
+    Parameters:
+    - queries: the (Q, L) matrix of query sequences
+    - dataset: the (N, L) matrix of dataset sequences
+    - r: the warping window of LB_Keogh
+
+    Returns:
+    - The (Q, N) matrices of the LB_Yi, LB_Kim and LB_Keogh lower bounds
+    """
+    queries = np.asarray(queries, dtype=float)
+    dataset = np.asarray(dataset, dtype=float)
+    LB_Yi = np.empty((len(queries), len(dataset)))
+    LB_Kim = np.empty_like(LB_Yi)
+    LB_Keogh = np.empty_like(LB_Yi)
+    for i, query_sequence in enumerate(queries):
+        LB_Yi[i] = lb_yi_batch(query_sequence, dataset)
+        LB_Kim[i] = lb_kim_batch(query_sequence, dataset)
+        LB_Keogh[i] = lb_keogh_batch(query_sequence, dataset, r)
+    return LB_Yi, LB_Kim, LB_Keogh
+
+def tightness(dataset, distances, r=3):
+    """
+    Compute the ratio T of each lower bounding function from the pairwise DTW distances of a dataset.
+
+    Parameters:
+    - dataset: the dataset of time series sequences
+    - distances: the pairwise DTW distance matrix of the dataset
+    - r: the warping window of LB_Keogh
+
+    Returns:
+    - The ratio T for the LB_Yi, LB_Kim and LB_Keogh functions
+    """
+    # every pair once, i < j
+    pairs = np.triu_indices(len(dataset), 1)
+    return tuple(np.mean(np.minimum(1, bounds[pairs] / distances[pairs]))
+                 for bounds in lower_bound_matrices(dataset, dataset, r))
+
+def compute_T(dataset, r=3, max_workers=None, cache=None):
     """
     Compute the ratio T for each lower bounding function.
 
@@ -16,89 +67,85 @@ def compute_T(dataset):
 
     Parameters:
     - dataset: the dataset of time series sequences
-    
+    - r: the warping window shared by the DTW distance and LB_Keogh
+    - max_workers: the number of worker processes computing the DTW distances
+    - cache: the DTWCache the DTW distance matrices are memoized in, if any
+
     Returns:
     - T_Yi: the ratio T for the LB_Yi function
     - T_Kim: the ratio T for the LB_Kim function
     - T_Keogh: the ratio T for the LB_Keogh function
     """
-    num_sequences = len(dataset)
-    num_comparisons = int(num_sequences * (num_sequences - 1) / 2)
-    
-    # Initialize arrays to store distances
-    true_distances = np.zeros(num_comparisons)
-    LB_Yi_distances = np.zeros(num_comparisons)
-    LB_Kim_distances = np.zeros(num_comparisons)
-    LB_Keogh_distances = np.zeros(num_comparisons)
-    
-    idx = 0
-    for i in range(num_sequences):
-        for j in range(i+1, num_sequences):
-            # Compute true DTW distance
-            true_distances[idx] = dtw_distance(dataset[i], dataset[j])
-            
-            # Compute lower bound distances
-            LB_Yi_distances[idx] = lb_yi(dataset[i], dataset[j])
-            LB_Kim_distances[idx] = lb_kim(dataset[i], dataset[j])
-            LB_Keogh_distances[idx] = lb_keogh(dataset[i], dataset[j], r=3)
-            
-            idx += 1
-    
-    # Calculate the ratio T for each lower bounding function
-    T_Yi = np.mean(np.minimum(1, LB_Yi_distances / true_distances))
-    T_Kim = np.mean(np.minimum(1, LB_Kim_distances / true_distances))
-    T_Keogh = np.mean(np.minimum(1, LB_Keogh_distances / true_distances))
-    
-    return T_Yi, T_Kim, T_Keogh
-
-def perform_experiment_T(dataset, query_lengths, sample_size=50):
-    T_results = {length: {'yi': [], 'kim': [], 'keogh': []} for length in query_lengths}
-
-    for length in query_lengths:
-        sequences = [sequence[:length] for sequence in dataset[np.random.choice(len(dataset), sample_size, replace=False)]]
-
-        T_results[length]['yi'], T_results[length]['kim'], T_results[length]['keogh'] = compute_T(sequences)
+    dataset = np.asarray(dataset, dtype=float)
+    return tightness(dataset, true_distances(dataset, r=r, max_workers=max_workers, cache=cache), r)
+
+def perform_experiment_T(dataset, query_lengths, sample_size=50, r=3, max_workers=None, cache=None):
+    """
+    Compute the ratio T of each lower bounding function for several query lengths.
+
+    A single sample is drawn and truncated to each length, so that the DTW distances for
+    every length come out of one pass over the sample.
+
+    Parameters:
+    - dataset: the dataset of time series sequences
+    - query_lengths: the query lengths
+    - sample_size: the number of sequences sampled from the dataset
+    - r: the warping window shared by the DTW distance and LB_Keogh
+    - max_workers: the number of worker processes computing the DTW distances
+    - cache: the DTWCache the DTW distance matrices are memoized in, if any
 
+    Returns:
+    - A dictionary mapping each query length to the ratios T of the 'yi', 'kim' and 'keogh' functions
+    """
+    dataset = np.asarray(dataset, dtype=float)
+    sample = dataset[np.random.choice(len(dataset), sample_size, replace=False)]
+    lengths = [min(length, sample.shape[1]) for length in query_lengths]
+    distances = true_distances(sample, r=r, prefix_lengths=sorted(set(lengths)), max_workers=max_workers, cache=cache)
+    by_length = dict(zip(sorted(set(lengths)), distances))
+
+    T_results = {}
+    for length, effective_length in zip(query_lengths, lengths):
+        T_Yi, T_Kim, T_Keogh = tightness(sample[:, :effective_length], by_length[effective_length], r)
+        T_results[length] = {'yi': T_Yi, 'kim': T_Kim, 'keogh': T_Keogh}
     return T_results
 
 
-def compute_P(query, dataset):
+def compute_P(query, dataset, r=3, max_workers=None, cache=None):
     """
     Compute the Pruning Power (P) for each method.
 
     P = Number of Objects that do not require DTW / Total Number of Objects
 
     Parameters:
-    - query: the query sequence
+    - query: the query sequences
     - dataset: the dataset of time series sequences
+    - r: the warping window shared by the DTW distance and LB_Keogh
+    - max_workers: the number of worker processes computing the DTW distances
+    - cache: the DTWCache the DTW distance matrices are memoized in, if any
 
     Returns:
     - P_Yi: the Pruning Power for the LB_Yi function
     - P_Kim: the Pruning Power for the LB_Kim function
     - P_Keogh: the Pruning Power for the LB_Keogh function
     """
+    query = np.asarray(query, dtype=float)
+    dataset = np.asarray(dataset, dtype=float)
+    distances = true_distances(query, dataset, r, max_workers=max_workers, cache=cache)
+    LB_Yi, LB_Kim, LB_Keogh = lower_bound_matrices(query, dataset, r)
+
     LB_Yi_pruned_count = 0
     LB_Kim_pruned_count = 0
     LB_Keogh_pruned_count = 0
-    
-    for query_sequence in query:
-
-        other_sequences = np.delete(dataset, np.where(dataset == query_sequence)[0], axis=0)
-        
-        # Calculate the true DTW distance
-        true_distances = [dtw_distance(query_sequence, other_sequence) for other_sequence in other_sequences]
-        
-        LB_Yi_distances = [lb_yi(query_sequence, other_sequence) for other_sequence in other_sequences]
-        LB_Kim_distances = [lb_kim(query_sequence, other_sequence) for other_sequence in other_sequences]
-        LB_Keogh_distances = [lb_keogh(query_sequence, other_sequence, r=3) for other_sequence in other_sequences]
-
-        # Find the nearest match using the true DTW distance
-        nearest_match = np.argmin(true_distances)
-
-        # Find the nearest match using the LB_Yi distance
-        nearest_match_Yi = np.argmin(LB_Yi_distances)
-        nearest_match_Kim = np.argmin(LB_Kim_distances)
-        nearest_match_Keogh = np.argmin(LB_Keogh_distances)
+
+    for i, query_sequence in enumerate(query):
+        # the query itself is not a candidate, it is masked out rather than deleted from a copy of the dataset
+        excluded = np.all(dataset == query_sequence, axis=1)
+
+        # Find the nearest match using the true DTW distance and each lower bound
+        nearest_match = np.argmin(np.where(excluded, np.inf, distances[i]))
+        nearest_match_Yi = np.argmin(np.where(excluded, np.inf, LB_Yi[i]))
+        nearest_match_Kim = np.argmin(np.where(excluded, np.inf, LB_Kim[i]))
+        nearest_match_Keogh = np.argmin(np.where(excluded, np.inf, LB_Keogh[i]))
 
         # If the nearest match using the LB_Yi distance is the same as the nearest match using the true DTW distance
         # then we have pruned the search space
@@ -114,4 +161,4 @@ def compute_P(query, dataset):
     P_Kim = LB_Kim_pruned_count / len(query)
     P_Keogh = LB_Keogh_pruned_count / len(query)
 
-    return P_Yi, P_Kim, P_Keogh
\ No newline at end of file
+    return P_Yi, P_Kim, P_Keogh
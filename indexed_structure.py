@@ -1,60 +1,621 @@
 """
 This file contains the implementation of the indexed structure for time series indexing.
 
+The PAA representations are stored in an R-tree: leaf nodes hold the entries, internal
+nodes hold child nodes, and every node keeps the Minimum Bounding Rectangle (MBR) of
+each of its children. Nodes store their children as contiguous NumPy blocks (one row of
+MBR lows and one row of MBR highs per child, the PAA points themselves in a leaf), so
+the lower bounds of all the children of a node are computed with one vectorized call.
+
 Author:
 - Artur Dandolini Pescador
 """
 
+import json
+import os
+from collections import Counter
 import numpy as np
+from reducers import PAA, ChannelPAA, reducer_from_state
 
 class Node:
-    def __init__(self, is_leaf=False):
+    __slots__ = ('is_leaf', 'count', 'lows', 'highs', 'ids', 'sequences', 'children', 'parent')
+
+    def __init__(self, is_leaf, paa_size, capacity, dtype=float):
         self.is_leaf = is_leaf # boolean
-        self.entries = []
+        self.count = 0 # number of children (or entries) in use
+        self.lows = np.empty((capacity, paa_size), dtype=dtype) # MBR lows of the children, one row each
+        # the MBR of an entry is its PAA point, so a leaf stores the points only once
+        self.highs = self.lows if is_leaf else np.empty((capacity, paa_size), dtype=dtype)
+        self.ids = np.empty(capacity, dtype=np.int64) if is_leaf else None
+        self.sequences = [] if is_leaf else None # original sequences, aligned with ids
+        self.children = None if is_leaf else [] # child nodes, aligned with lows and highs
+        self.parent = None
+
+    def add_entry(self, entry_id, paa_representation, sequence):
+        """Add an entry to a leaf node."""
+        self.lows[self.count] = paa_representation
+        self.ids[self.count] = entry_id
+        self.sequences.append(sequence)
+        self.count += 1
+
+    def add_child(self, child):
+        """Add a child node to an internal node."""
+        self.lows[self.count], self.highs[self.count] = child.bounds()
+        self.children.append(child)
+        child.parent = self
+        self.count += 1
+
+    def keep(self, positions):
+        """Keep only the children (or entries) at the given positions, in that order."""
+        positions = np.asarray(positions, dtype=int)
+        self.lows[:len(positions)] = self.lows[positions]
+        if self.is_leaf:
+            self.ids[:len(positions)] = self.ids[positions]
+            self.sequences = [self.sequences[p] for p in positions]
+        else:
+            self.highs[:len(positions)] = self.highs[positions]
+            self.children = [self.children[p] for p in positions]
+        self.count = len(positions)
 
-    def add_entry(self, entry):
-        """Add an entry to the node."""
-        self.entries.append(entry)
+    def bounds(self):
+        """Lows and highs of the MBR of everything below the node."""
+        return self.lows[:self.count].min(axis=0), self.highs[:self.count].max(axis=0)
+
+    @property
+    def mbr(self):
+        """MBR of everything below the node, as (low, high) pairs, or None if empty."""
+        if self.count == 0:
+            return None
+        return np.column_stack(self.bounds())
+
+    @property
+    def entries(self):
+        """The child nodes, or views of the entries of a leaf."""
+        if not self.is_leaf:
+            return list(self.children)
+        return [Entry(self.lows[p], original_sequence=self.sequences[p], entry_id=int(self.ids[p])) for p in range(self.count)]
 
 class Entry:
-    def __init__(self, paa_representation, original_sequence=None, mbr=None, lb_distance=np.inf):
+    __slots__ = ('id', 'paa_representation', 'original_sequence')
+
+    def __init__(self, paa_representation, original_sequence=None, entry_id=None):
+        self.id = entry_id # identifier of the series in the indexed structure
         self.paa_representation = paa_representation # PAA
         self.original_sequence = original_sequence # Original time series sequence
-        self.mbr = mbr # MBR
+
+    @property
+    def mbr(self):
+        """MBR of the entry: its PAA point."""
+        return np.column_stack((self.paa_representation, self.paa_representation))
 
 class IndexedStructure:
-    def __init__(self, paa_size):
-        self.root = Node(is_leaf=True)  # Assuming root is leaf node
-        self.paa_size = paa_size
+    def __init__(self, paa_size, max_entries=16, min_entries=None, reducer=None):
+        # dimensionality reduction of the series (PAA unless another reducer is given)
+        self.reducer = reducer if reducer is not None else PAA(paa_size)
+        self.paa_size = self.reducer.dims
+        self.next_id = 0 # identifier given to the next inserted series
+        self.leaf_of = {} # leaf holding each identifier
+        self.lengths = Counter() # number of indexed series of each length
+        self.max_entries = max_entries # fan-out of the tree
+        # R*-tree default: nodes are split into groups of at least 40% of the fan-out
+        # at least 2, or splits keep cutting single-child nodes off that never fill up
+        self.min_entries = min_entries if min_entries is not None else max(2, int(0.4 * max_entries))
+        if not 2 <= self.min_entries <= self.max_entries // 2:
+            raise ValueError("min_entries must be between 2 and max_entries / 2 (max_entries must be at least 4)")
+        self.root = self.new_node(is_leaf=True)
+
+    @property
+    def series_length(self):
+        """Length shared by all the indexed series, or None if they differ (or there are none)."""
+        return next(iter(self.lengths)) if len(self.lengths) == 1 else None
+
+    def count_length(self, timeseries, step=1):
+        """Count a series in (or out of, with step=-1) the number of indexed series of its length."""
+        length = len(timeseries)
+        self.lengths[length] += step
+        if not self.lengths[length]:
+            del self.lengths[length]
+
+    def new_node(self, is_leaf):
+        """Empty node, with room for one extra child before it must be split."""
+        return Node(is_leaf, self.paa_size, self.max_entries + 1, self.reducer.dtype)
+
+    @classmethod
+    def bulk_load(cls, timeseries, paa_size, max_entries=16, min_entries=None, reducer=None):
+        """
+        Build an indexed structure from a whole dataset with Sort-Tile-Recursive packing.
+
+        The PAA of every series is computed in one vectorized pass, then the entries are
+        tiled into fully filled leaves and the leaves into upper levels the same way, which
+        gives a balanced tree with much tighter MBRs than one insert per series.
+
+        Parameters:
+        - timeseries: the (N, L) matrix of time series
+        - paa_size: the number of PAA dimensions
+        - max_entries: the fan-out of the tree
+        - min_entries: the minimum number of entries of a node
+        - reducer: the dimensionality reduction, fitted to the dataset (by default, PAA with paa_size dimensions)
+
+        Returns:
+        - The indexed structure holding every series of the dataset
+        """
+        index = cls(paa_size, max_entries=max_entries, min_entries=min_entries, reducer=reducer)
+        timeseries = np.asarray(timeseries)
+        if len(timeseries) == 0:
+            return index
+        index.reducer.fit(timeseries)
+        index.build(index.paa(timeseries), timeseries, np.arange(len(timeseries)))
+        index.next_id = len(timeseries)
+        return index
+
+    def build(self, paa_representations, sequences, ids):
+        """Replace the tree by an STR-packed tree of the given entries."""
+        self.leaf_of = {}
+        self.lengths = Counter(len(sequence) for sequence in sequences)
+        nodes = []
+        for group in self.pack(paa_representations, paa_representations):
+            leaf = self.new_node(is_leaf=True)
+            for position in group:
+                leaf.add_entry(ids[position], paa_representations[position], sequences[position])
+                self.leaf_of[int(ids[position])] = leaf
+            nodes.append(leaf)
+        while len(nodes) > 1:
+            bounds = [node.bounds() for node in nodes]
+            groups = self.pack(np.array([low for low, _ in bounds]), np.array([high for _, high in bounds]))
+            parents = []
+            for group in groups:
+                parent = self.new_node(is_leaf=False)
+                for position in group:
+                    parent.add_child(nodes[position])
+                parents.append(parent)
+            nodes = parents
+        self.root = nodes[0]
+
+    def pack(self, lows, highs):
+        """Group the rectangles of one tree level into nodes with STR tiling."""
+        # as floats, so that the sum of SAX symbols does not wrap around
+        centers = (lows.astype(float) + highs.astype(float)) / 2
+        groups = self.str_tile(np.arange(len(centers)), centers, 0)
+        if len(groups) > 1 and len(groups[-1]) < self.min_entries:
+            # only the very last tile can be partially filled: top it up from its neighbour
+            combined = np.concatenate(groups[-2:])
+            groups[-2:] = [combined[:-self.min_entries], combined[-self.min_entries:]]
+        return groups
+
+    def str_tile(self, indices, centers, dim):
+        """
+        Sort-Tile-Recursive partition of indices into groups of at most max_entries.
+
+        The items are sorted along dimension dim and cut into slabs, each slab being
+        tiled recursively along the next dimension, so that every group but the last
+        one is full.
+        """
+        n = len(indices)
+        if n <= self.max_entries:
+            return [indices]
+        order = indices[np.argsort(centers[indices, dim], kind='stable')]
+        if dim == centers.shape[1] - 1:
+            return [order[start:start + self.max_entries] for start in range(0, n, self.max_entries)]
+        num_nodes = -(-n // self.max_entries)
+        num_slabs = int(np.ceil(num_nodes ** (1 / (centers.shape[1] - dim))))
+        slab_size = self.max_entries * -(-num_nodes // num_slabs)
+        groups = []
+        for start in range(0, n, slab_size):
+            groups.extend(self.str_tile(order[start:start + slab_size], centers, dim + 1))
+        return groups
 
     def paa(self, timeseries):
-        """Piecewise Aggregate Approximation (PAA)"""
-        n = len(timeseries)
-        paa = np.zeros(self.paa_size)
-        for i in range(self.paa_size):
-            start = int(i * n / self.paa_size)
-            end = int((i + 1) * n / self.paa_size)
-            paa[i] = np.mean(timeseries[start:end])
-        return paa
-    
-    def insert(self, timeseries):
-        """Insert a time series into the indexed structure."""
-        paa_representation = self.paa(timeseries)
-        entry = Entry(paa_representation, original_sequence=timeseries)
-        entry.mbr = self.create_mbr(paa_representation)  # Create MBR during insertion
-        self.root.add_entry(entry)
-
-    def create_mbr(self, paa_representation):
-        """Create a Minimum Bounding Rectangle (MBR) for a PAA representation."""
-        mbr = np.zeros((self.paa_size, 2))
-        for i in range(self.paa_size):
-            mbr[i][0] = paa_representation[i]
-            mbr[i][1] = paa_representation[i]
-        return mbr
-    
+        """Reduced representation (the PAA by default) of a time series, or of each row of a matrix."""
+        return self.reducer.reduce(timeseries)
+
+    def insert(self, timeseries, paa_representation=None):
+        """
+        Insert a time series into the indexed structure.
+
+        Parameters:
+        - timeseries: the time series
+        - paa_representation: the PAA of the time series, if already computed
+
+        Returns:
+        - The identifier of the series, stable until it is deleted
+        """
+        entry_id = self.next_id
+        self.next_id += 1
+        self.insert_entry(entry_id, timeseries, paa_representation)
+        return entry_id
+
+    def insert_entry(self, entry_id, timeseries, paa_representation=None):
+        """Insert a time series under a given identifier."""
+        if paa_representation is None:
+            paa_representation = self.paa(timeseries)
+        leaf = self.choose_leaf(paa_representation)
+        leaf.add_entry(entry_id, paa_representation, timeseries)
+        self.leaf_of[entry_id] = leaf
+        self.count_length(timeseries)
+        self.adjust_tree(leaf)
+
+    def delete(self, entry_id):
+        """
+        Delete a time series from the indexed structure.
+
+        The tree is condensed as in Guttman's R-tree: nodes left with fewer than
+        min_entries entries are removed and their entries reinserted, and a root
+        left with a single child is replaced by it.
+
+        Parameters:
+        - entry_id: the identifier returned when the series was inserted
+
+        Returns:
+        - The deleted time series
+        """
+        if entry_id not in self.leaf_of:
+            raise KeyError(f"No time series with id {entry_id} in the indexed structure")
+        leaf = self.leaf_of.pop(entry_id)
+        position = int(np.flatnonzero(leaf.ids[:leaf.count] == entry_id)[0])
+        sequence = leaf.sequences[position]
+        self.count_length(sequence, -1)
+        leaf.keep([p for p in range(leaf.count) if p != position])
+        self.condense_tree(leaf)
+        return sequence
+
+    def update(self, entry_id, timeseries):
+        """Replace the time series stored under an identifier."""
+        self.delete(entry_id)
+        self.insert_entry(entry_id, timeseries)
+
+    def condense_tree(self, node):
+        """Walk from a leaf that lost an entry up to the root, dissolving underfull nodes."""
+        orphans = []
+        while node.parent is not None:
+            parent = node.parent
+            if node.count < self.min_entries:
+                position = parent.children.index(node)
+                parent.keep([p for p in range(parent.count) if p != position])
+                node.parent = None
+                orphans.append(node)
+            else:
+                self.refresh(node)
+            node = parent
+        while not self.root.is_leaf and self.root.count == 1:
+            self.root = self.root.children[0]
+            self.root.parent = None
+        if not self.root.is_leaf and self.root.count == 0:
+            self.root = self.new_node(is_leaf=True)
+
+        # reinsert the entries of the dissolved subtrees
+        stack = orphans
+        while stack:
+            orphan = stack.pop()
+            if orphan.is_leaf:
+                for position in range(orphan.count):
+                    self.count_length(orphan.sequences[position], -1) # counted again by insert_entry
+                    self.insert_entry(int(orphan.ids[position]), orphan.sequences[position], orphan.lows[position].copy())
+            else:
+                stack.extend(orphan.children)
+
+    def ingest(self, timeseries, batch_size=256):
+        """
+        Insert a stream of time series, buffered and flushed into the tree in batches.
+
+        The PAA of each batch is computed in one vectorized pass; a batch arriving in an
+        empty indexed structure is STR-packed rather than inserted one series at a time.
+
+        Parameters:
+        - timeseries: an iterable of time series
+        - batch_size: the number of series buffered before each flush
+
+        Returns:
+        - The identifiers of the inserted series, in arrival order
+        """
+        ids, batch = [], []
+        for sequence in timeseries:
+            batch.append(sequence)
+            if len(batch) == batch_size:
+                ids.extend(self.flush(batch))
+                batch = []
+        if batch:
+            ids.extend(self.flush(batch))
+        return ids
+
+    def flush(self, batch):
+        """Insert a batch of buffered time series, returning their identifiers."""
+        ids = list(range(self.next_id, self.next_id + len(batch)))
+        self.next_id += len(batch)
+        if len({len(sequence) for sequence in batch}) > 1:
+            for entry_id, sequence in zip(ids, batch):
+                self.insert_entry(entry_id, sequence)
+            return ids
+        paa_representations = self.paa(np.stack(batch))
+        if not self.leaf_of:
+            self.build(paa_representations, batch, ids)
+        else:
+            for entry_id, sequence, paa_representation in zip(ids, batch, paa_representations):
+                self.insert_entry(entry_id, sequence, paa_representation)
+        return ids
+
+    def choose_leaf(self, paa_representation):
+        """Descend to the leaf whose MBR needs the least enlargement to contain the PAA point."""
+        node = self.root
+        while not node.is_leaf:
+            lows, highs = node.lows[:node.count], node.highs[:node.count]
+            # MBRs are measured by their margin (sum of edge lengths): the volume of a PAA
+            # point is zero, and in 16 or more dimensions products of edges underflow
+            sizes = np.sum(highs - lows, axis=1)
+            enlargement = np.sum(np.maximum(highs, paa_representation) - np.minimum(lows, paa_representation), axis=1) - sizes
+            # least enlargement first, ties resolved by the smallest MBR
+            node = node.children[np.lexsort((sizes, enlargement))[0]]
+        return node
+
+    def adjust_tree(self, node):
+        """Walk from node up to the root, splitting overflowing nodes and refreshing MBRs."""
+        while node is not None:
+            parent = node.parent
+            if node.count > self.max_entries:
+                sibling = self.split(node)
+                if parent is None:
+                    # the root was split: the tree grows by one level
+                    self.root = self.new_node(is_leaf=False)
+                    self.root.add_child(node)
+                    self.root.add_child(sibling)
+                else:
+                    self.refresh(node)
+                    parent.add_child(sibling)
+            elif parent is not None:
+                self.refresh(node)
+            node = parent
+
+    def refresh(self, node):
+        """Copy the MBR of node into its row of the parent."""
+        position = node.parent.children.index(node)
+        node.parent.lows[position], node.parent.highs[position] = node.bounds()
+
+    def split(self, node):
+        """
+        Split an overflowing node in two with Guttman's quadratic split.
+
+        Parameters:
+        - node: the node to split
+
+        Returns:
+        - The new sibling node, holding part of the entries of node
+        """
+        # as floats, so that the waste of overlapping SAX words does not wrap around
+        lows, highs = node.lows[:node.count].astype(float), node.highs[:node.count].astype(float)
+        sizes = np.sum(highs - lows, axis=1)
+
+        # seeds: the pair of entries wasting the most space when grouped together
+        union_sizes = np.sum(np.maximum(highs[:, None], highs[None, :]) - np.minimum(lows[:, None], lows[None, :]), axis=-1)
+        waste = union_sizes - sizes[:, None] - sizes[None, :]
+        np.fill_diagonal(waste, -np.inf)
+        seed1, seed2 = np.unravel_index(np.argmax(waste), waste.shape)
+
+        groups = [[seed1], [seed2]]
+        group_lows = [lows[seed1].copy(), lows[seed2].copy()]
+        group_highs = [highs[seed1].copy(), highs[seed2].copy()]
+        remaining = [i for i in range(node.count) if i != seed1 and i != seed2]
+        while remaining:
+            # if a group needs every remaining entry to reach the minimum, give them all
+            for g in range(2):
+                if len(groups[g]) + len(remaining) == self.min_entries:
+                    groups[g].extend(remaining)
+                    remaining = []
+            if not remaining:
+                break
+            candidates = np.array(remaining)
+            group_sizes = [np.sum(group_highs[g] - group_lows[g]) for g in range(2)]
+            enlargements = [np.sum(np.maximum(highs[candidates], group_highs[g]) - np.minimum(lows[candidates], group_lows[g]), axis=1) - group_sizes[g]
+                            for g in range(2)]
+            # assign the entry with the strongest preference for one of the groups
+            pick = np.argmax(np.abs(enlargements[0] - enlargements[1]))
+            d1, d2 = enlargements[0][pick], enlargements[1][pick]
+            if d1 != d2:
+                g = 0 if d1 < d2 else 1
+            elif group_sizes[0] != group_sizes[1]:
+                g = 0 if group_sizes[0] < group_sizes[1] else 1
+            else:
+                g = 0 if len(groups[0]) <= len(groups[1]) else 1
+            index = remaining.pop(pick)
+            groups[g].append(index)
+            group_lows[g] = np.minimum(group_lows[g], lows[index])
+            group_highs[g] = np.maximum(group_highs[g], highs[index])
+
+        sibling = self.new_node(is_leaf=node.is_leaf)
+        for position in groups[1]:
+            if node.is_leaf:
+                sibling.add_entry(node.ids[position], node.lows[position], node.sequences[position])
+                self.leaf_of[int(node.ids[position])] = sibling
+            else:
+                sibling.add_child(node.children[position])
+        node.keep(groups[0])
+        return sibling
+
+    def iter_leaves(self):
+        """Iterate over the leaf nodes of the indexed structure."""
+        stack = [self.root]
+        while stack:
+            node = stack.pop()
+            if node.is_leaf:
+                yield node
+            else:
+                stack.extend(node.children)
+
+    def iter_entries(self):
+        """Iterate over every entry stored in the indexed structure."""
+        for leaf in self.iter_leaves():
+            yield from leaf.entries
+
+    def sequence(self, entry_id):
+        """Retrieve the time series stored under an identifier."""
+        if entry_id not in self.leaf_of:
+            raise KeyError(f"No time series with id {entry_id} in the indexed structure")
+        leaf = self.leaf_of[entry_id]
+        return leaf.sequences[int(np.flatnonzero(leaf.ids[:leaf.count] == entry_id)[0])]
+
+    def __len__(self):
+        return len(self.leaf_of)
+
+    def height(self):
+        """Number of levels of the tree."""
+        node, levels = self.root, 1
+        while not node.is_leaf:
+            node, levels = node.children[0], levels + 1
+        return levels
+
     def retrieve_full_sequence(self, paa_representation):
         """Retrieve the full sequence from the indexed structure."""
-        for entry in self.root.entries:
+        for entry in self.iter_entries():
             if np.array_equal(entry.paa_representation, paa_representation):
                 return entry.original_sequence
-        return None
\ No newline at end of file
+        return None
+
+    def save(self, path, dtype=None):
+        """
+        Save the indexed structure to a directory, in a columnar format that open() memory-maps.
+
+        The directory holds the series as one contiguous (N, L) array, their PAA vectors,
+        the MBR of every node, and the tree topology as arrays of node children in
+        breadth-first order (child node indices for internal nodes, series rows for leaves).
+
+        Parameters:
+        - path: the directory to write
+        - dtype: the dtype of the stored series (by default, the one of the indexed series)
+        """
+        entries = sorted(self.iter_entries(), key=lambda entry: entry.id)
+        rows = {entry.id: row for row, entry in enumerate(entries)}
+        if len({len(entry.original_sequence) for entry in entries}) > 1:
+            raise ValueError("Only series of the same length can be saved")
+        shape = np.shape(entries[0].original_sequence) if entries else (0,)
+
+        # breadth-first numbering of the nodes, children stored contiguously
+        nodes, is_leaf, offsets, children = [self.root], [], [0], []
+        for node in nodes:
+            is_leaf.append(node.is_leaf)
+            if node.is_leaf:
+                children.extend(rows[int(entry_id)] for entry_id in node.ids[:node.count])
+            else:
+                children.extend(range(len(nodes), len(nodes) + node.count))
+                nodes.extend(node.children)
+            offsets.append(len(children))
+        empty_mbr = np.full((self.paa_size, 2), np.nan)
+
+        os.makedirs(path, exist_ok=True)
+        # the series may be rows of the series.npy of path itself (if the index was opened
+        # from it): they are written to a new file which then replaces the mapped one
+        series_path = os.path.join(path, 'series.npy')
+        if dtype is None:
+            # from the distinct dtypes only: the series may be lists, and be many
+            dtype = np.result_type(*{np.asarray(entry.original_sequence).dtype for entry in entries}) if entries else float
+        series = np.lib.format.open_memmap(series_path + '.tmp', mode='w+', dtype=dtype, shape=(len(entries),) + shape)
+        for row, entry in enumerate(entries):
+            series[row] = entry.original_sequence
+        series.flush()
+        del series
+        os.replace(series_path + '.tmp', series_path)
+        np.save(os.path.join(path, 'ids.npy'), np.array([entry.id for entry in entries], dtype=np.int64))
+        np.save(os.path.join(path, 'paa.npy'), np.array([entry.paa_representation for entry in entries], dtype=float).reshape(len(entries), self.paa_size))
+        np.save(os.path.join(path, 'node_mbrs.npy'), np.array([node.mbr if node.count else empty_mbr for node in nodes]))
+        np.save(os.path.join(path, 'node_is_leaf.npy'), np.array(is_leaf))
+        np.save(os.path.join(path, 'node_offsets.npy'), np.array(offsets, dtype=np.int64))
+        np.save(os.path.join(path, 'node_children.npy'), np.array(children, dtype=np.int64))
+        with open(os.path.join(path, 'meta.json'), 'w') as f:
+            json.dump(self.metadata(), f)
+
+    def metadata(self):
+        """Settings written to meta.json by save()."""
+        return {'paa_size': self.paa_size, 'max_entries': self.max_entries,
+                'min_entries': self.min_entries, 'next_id': self.next_id, 'reducer': self.reducer.state()}
+
+    @classmethod
+    def from_metadata(cls, meta):
+        """Empty indexed structure with the settings read from meta.json by open()."""
+        reducer = reducer_from_state(meta['reducer']) if 'reducer' in meta else None
+        return cls(meta['paa_size'], max_entries=meta['max_entries'], min_entries=meta['min_entries'], reducer=reducer)
+
+    @classmethod
+    def open(cls, path):
+        """
+        Open an indexed structure written by save().
+
+        The series are memory-mapped rather than read: each leaf holds rows of the mapping,
+        so only the pages of the candidates that reach the DTW computation are loaded.
+
+        Parameters:
+        - path: the directory written by save()
+
+        Returns:
+        - The indexed structure
+        """
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        index = cls.from_metadata(meta)
+        index.next_id = meta['next_id']
+        series = np.load(os.path.join(path, 'series.npy'), mmap_mode='r')
+        ids = np.load(os.path.join(path, 'ids.npy'))
+        paa_representations = np.load(os.path.join(path, 'paa.npy'))
+        node_mbrs = np.load(os.path.join(path, 'node_mbrs.npy'))
+        is_leaf = np.load(os.path.join(path, 'node_is_leaf.npy'))
+        offsets = np.load(os.path.join(path, 'node_offsets.npy'))
+        children = np.load(os.path.join(path, 'node_children.npy'))
+
+        nodes = [index.new_node(is_leaf=bool(leaf)) for leaf in is_leaf]
+        for position, node in enumerate(nodes):
+            node_children = children[offsets[position]:offsets[position + 1]]
+            count = len(node_children)
+            if node.is_leaf:
+                node.lows[:count] = paa_representations[node_children]
+                node.ids[:count] = ids[node_children]
+                node.sequences = [series[row] for row in node_children]
+                index.leaf_of.update((int(entry_id), node) for entry_id in ids[node_children])
+            else:
+                node.lows[:count] = node_mbrs[node_children, :, 0]
+                node.highs[:count] = node_mbrs[node_children, :, 1]
+                node.children = [nodes[child] for child in node_children]
+                for child in node.children:
+                    child.parent = node
+            node.count = count
+        index.root = nodes[0]
+        if len(ids):
+            index.lengths[series.shape[1]] = len(ids)
+        return index
+
+class MultivariateIndexedStructure(IndexedStructure):
+    """
+    Indexed structure of (L, C) multivariate time series.
+
+    Every series is indexed by the PAA of each of its channels, concatenated, so the MBRs
+    bound all the channels at once and a single search covers them, instead of one index
+    per channel whose results would have to be merged.
+    """
+    def __init__(self, segments, channels, max_entries=16, min_entries=None):
+        self.segments = segments # PAA dimensions of each channel
+        self.channels = channels
+        super().__init__(segments * channels, max_entries=max_entries, min_entries=min_entries,
+                         reducer=ChannelPAA(segments, channels))
+
+    @classmethod
+    def bulk_load(cls, timeseries, segments, max_entries=16, min_entries=None):
+        """
+        Build an indexed structure from a whole dataset with Sort-Tile-Recursive packing.
+
+        Parameters:
+        - timeseries: the (N, L, C) stack of multivariate time series
+        - segments: the number of PAA dimensions of each channel
+        - max_entries: the fan-out of the tree
+        - min_entries: the minimum number of entries of a node
+
+        Returns:
+        - The indexed structure holding every series of the dataset
+        """
+        timeseries = np.asarray(timeseries)
+        index = cls(segments, timeseries.shape[-1], max_entries=max_entries, min_entries=min_entries)
+        if len(timeseries) == 0:
+            return index
+        index.build(index.paa(timeseries), timeseries, np.arange(len(timeseries)))
+        index.next_id = len(timeseries)
+        return index
+
+    @classmethod
+    def from_metadata(cls, meta):
+        """Empty indexed structure with the settings read from meta.json by open()."""
+        reducer = meta['reducer']
+        return cls(reducer['segments'], reducer['channels'], max_entries=meta['max_entries'], min_entries=meta['min_entries'])
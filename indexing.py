@@ -6,79 +6,393 @@ Author:
 """
 
 import heapq
-from dtw_functions import lb_paa, mindist, dtw_distance
+import itertools
+import time
+from dtw_functions import dtw_distance, lb_kim_fl, lb_keogh_envelope
+from envelope import Envelope, MultivariateEnvelope, compute_envelope, compute_channel_envelopes
+from multivariate_functions import dtw_distance_dependent, dtw_distance_independent, lb_kim_multivariate, lb_keogh_multivariate
 import numpy as np
 from indexed_structure import Entry
 
-def knn_search(indexed_structure, query_sequence, k):
+class LowerBoundCascade:
     """
-    Perform a k-NN search on the indexed structure.
+    Chain of lower bounds applied, cheapest first, before the DTW distance of a candidate.
+
+    The stages are LB_Kim on the first and last points (O(1)), LB_Keogh of the candidate
+    against the query envelope, and LB_Keogh with the roles reversed. A candidate is
+    pruned by the first stage whose bound exceeds the best-so-far distance; survivors get
+    an early-abandoning banded DTW, seeded with the cumulative contributions of the
+    tighter LB_Keogh. The number of candidates stopped at each stage is kept in pruned,
+    the DTW calls that were abandoned being counted under 'dtw'.
+
+    A (L, C) query is multivariate: the bounds are summed over the channels and the
+    distance is the dependent DTW, or the independent one if dependent is False.
+    """
+    STAGES = ('kim', 'keogh', 'keogh_reversed')
+
+    def __init__(self, query_sequence, r=None, stages=STAGES, envelope=None, dependent=True):
+        unknown = set(stages) - set(self.STAGES)
+        if unknown:
+            raise ValueError(f"Unknown cascade stages: {sorted(unknown)}")
+        self.query_sequence = np.asarray(query_sequence, dtype=float)
+        self.r = r
+        self.stages = tuple(stages)
+        if self.query_sequence.ndim == 2:
+            self.lb_kim, self.lb_keogh, self.candidate_envelope = lb_kim_multivariate, lb_keogh_multivariate, compute_channel_envelopes
+            self.dtw = dtw_distance_dependent if dependent else dtw_distance_independent
+            if envelope is None:
+                envelope = MultivariateEnvelope(self.query_sequence, r)
+        else:
+            self.lb_kim, self.lb_keogh, self.candidate_envelope = lb_kim_fl, lb_keogh_envelope, compute_envelope
+            self.dtw = dtw_distance
+        self.envelope = envelope if envelope is not None else Envelope(self.query_sequence, r)
+        self.pruned = dict.fromkeys(self.stages + ('dtw',), 0)
+        self.dtw_calls = 0
+
+    def distance(self, candidate, best_so_far=np.inf, envelope=None, stats=None):
+        """
+        Compute the DTW distance to a candidate unless a lower bound proves it exceeds best_so_far.
+
+        Parameters:
+        - candidate: the candidate time series
+        - best_so_far: the distance above which the candidate is of no interest
+        - envelope: the (upper, lower) envelope of the candidate, if already known
+        - stats: the SearchStats recording the pruning, DTW cells and timings, if any
+
+        Returns:
+        - The DTW distance between the query and the candidate, or np.inf if it exceeds best_so_far
+        """
+        query = self.query_sequence
+        candidate = np.asarray(candidate, dtype=float)
+        same_length = len(candidate) == len(query)
+        contributions = None
+        for stage in self.stages:
+            started = time.perf_counter()
+            if stage == 'kim':
+                bound = self.lb_kim(query, candidate)
+            elif not same_length:
+                continue # LB_Keogh is only defined between series of the same length
+            elif stage == 'keogh':
+                bound, stage_contributions = self.lb_keogh(candidate, self.envelope.upper, self.envelope.lower)
+            else:
+                upper, lower = self.candidate_envelope(candidate, self.r) if envelope is None else envelope
+                bound, stage_contributions = self.lb_keogh(query, upper, lower)
+            if stats is not None:
+                stats.timings[stage] += time.perf_counter() - started
+            if bound > best_so_far:
+                self.pruned[stage] += 1
+                if stats is not None:
+                    stats.pruned[stage] += 1
+                return np.inf
+            if stage != 'kim' and (contributions is None or stage_contributions.sum() > contributions.sum()):
+                contributions = stage_contributions
+
+        # cb[k]: squared cost still to be paid for the points from k onwards (per channel if multivariate)
+        cb = None
+        if contributions is not None:
+            cb = np.cumsum(contributions[::-1], axis=0)[::-1]
+            cb = np.concatenate((cb, np.zeros((1,) + cb.shape[1:]))).tolist()
+        self.dtw_calls += 1
+        started = time.perf_counter()
+        distance = self.dtw(query, candidate, self.r, best_so_far, cb, stats)
+        if distance > best_so_far:
+            self.pruned['dtw'] += 1
+        if stats is not None:
+            stats.timings['dtw'] += time.perf_counter() - started
+            stats.dtw_calls += 1
+            if distance > best_so_far:
+                stats.pruned['dtw'] += 1
+        return distance
+
+class SearchStats:
+    """
+    Counters and timings of the searches it is passed to, accumulated over all of them.
+
+    nodes_visited counts the nodes whose children or entries were bounded, and
+    entries_examined the entries that reached the lower bound cascade. pruned counts the
+    children discarded by MINDIST, the entries discarded by LB_PAA and the candidates
+    stopped by each stage of the cascade, 'dtw' counting the abandoned DTW computations.
+    dtw_cells and abandoned_cells count the band cells computed and skipped thanks to
+    early abandoning. timings holds the seconds spent bounding the nodes ('mindist'), in
+    each stage of the cascade, in the DTW and in the whole searches ('total').
+
+    When given, hook is called with the stats at the end of each search, e.g. to export
+    them to a metrics system.
+    """
+    def __init__(self, hook=None):
+        self.hook = hook
+        self.reset()
+
+    def reset(self):
+        """Set every counter and timing back to zero."""
+        self.searches = 0
+        self.nodes_visited = 0
+        self.entries_examined = 0
+        self.pruned = dict.fromkeys(('mindist', 'lb_paa') + LowerBoundCascade.STAGES + ('dtw',), 0)
+        self.dtw_calls = 0
+        self.dtw_cells = 0
+        self.abandoned_cells = 0
+        self.timings = dict.fromkeys(('mindist',) + LowerBoundCascade.STAGES + ('dtw', 'total'), 0.0)
+
+    def as_dict(self):
+        """Return the counters and timings as a flat dictionary."""
+        stats = {
+            'searches': self.searches,
+            'nodes_visited': self.nodes_visited,
+            'entries_examined': self.entries_examined,
+            'dtw_calls': self.dtw_calls,
+            'dtw_cells': self.dtw_cells,
+            'abandoned_cells': self.abandoned_cells,
+        }
+        stats.update({f"pruned_{stage}": count for stage, count in self.pruned.items()})
+        stats.update({f"time_{stage}": seconds for stage, seconds in self.timings.items()})
+        return stats
+
+    def record_node(self, node, kept, started):
+        """Count a visited node, the children or entries its bounds discarded and the time spent on them."""
+        self.timings['mindist'] += time.perf_counter() - started
+        self.nodes_visited += 1
+        self.pruned['lb_paa' if node.is_leaf else 'mindist'] += node.count - kept
+
+    def finish(self, started):
+        """Close a search started at the given time, calling the hook."""
+        self.searches += 1
+        self.timings['total'] += time.perf_counter() - started
+        if self.hook is not None:
+            self.hook(self)
+
+class KBest:
+    """
+    The k items of smallest distance seen so far, kept in a bounded max-heap.
+
+    kth_distance is the distance a new item must beat to be kept: np.inf until k items
+    are kept, and -np.inf if k <= 0, so that a search asked for no item stops at once.
+    """
+    def __init__(self, k):
+        self.k = k
+        self.heap = [] # (-distance, arrival, item)
+        self.arrivals = itertools.count() # tie-breaker, the items need not be comparable
+
+    def __len__(self):
+        return len(self.heap)
+
+    @property
+    def kth_distance(self):
+        """Distance a new item must beat to be kept."""
+        if self.k <= 0:
+            return -np.inf
+        return -self.heap[0][0] if len(self.heap) == self.k else np.inf
+
+    def push(self, distance, item):
+        """Keep an item if its distance beats kth_distance, evicting the farthest one; return whether it was kept."""
+        if not distance < self.kth_distance:
+            return False
+        if len(self.heap) == self.k:
+            heapq.heapreplace(self.heap, (-distance, next(self.arrivals), item))
+        else:
+            heapq.heappush(self.heap, (-distance, next(self.arrivals), item))
+        return True
+
+    def items(self):
+        """The (item, distance) pairs kept, by increasing distance then arrival."""
+        return [(item, -distance) for distance, _, item in sorted(self.heap, key=lambda kept: (-kept[0], kept[1]))]
+
+def reduced_query_bounds(indexed_structure, cascade):
+    """
+    Region of the reduced space holding the possible matches of the query of a cascade.
+
+    The reduced-space bounds (MINDIST, LB_PAA) are built from the query envelope and
+    segments, so they only bound the DTW distance to series of the length of the query:
+    the DTW band widens to the length difference otherwise.
+
+    Parameters:
+    - indexed_structure: the indexed structure
+    - cascade: the LowerBoundCascade of the query
+
+    Returns:
+    - The query bounds of the reducer of the index, or None if some indexed series differ in length from the query
+    """
+    if indexed_structure.series_length != len(cascade.query_sequence):
+        return None
+    return indexed_structure.reducer.query_bounds(cascade.envelope)
+
+def node_bounds(reducer, query_bounds, node):
+    """Lower bounds of the children of a node, zero if the query has no reduced-space bounds."""
+    if query_bounds is None:
+        return np.zeros(node.count)
+    return reducer.mindist(query_bounds, node.lows[:node.count], node.highs[:node.count])
+
+def knn_search(indexed_structure, query_sequence, k, r=None, cascade=None, stats=None):
+    """
+    Perform an exact k-NN search on the indexed structure.
+
+    Nodes and entries are visited in increasing order of their lower bound (MINDIST for
+    nodes, LB_PAA for entries, or the bounds of the reducer of the index) while the k best
+    true DTW distances found so far are kept in a bounded max-heap. The search stops as
+    soon as the lower bound at the head of the queue reaches the k-th best distance, since
+    nothing left in the queue can beat it.
 
     Parameters:
     - indexed_structure: the indexed structure
     - query_sequence: the query sequence
     - k: the number of neighbors to retrieve
+    - r: the warping window (None for the unconstrained DTW)
+    - cascade: the LowerBoundCascade filtering the candidates (by default, every stage with window r)
+    - stats: the SearchStats to record the pruning and timings of the search in, if any
 
     Returns:
-    - The k-nearest neighbors to the query sequence
+    - The k-nearest neighbors to the query sequence, as (sequence, distance) pairs sorted by distance
     """
-    # Init the MinPriorityQueue and the result list
+    neighbors = []
+    for neighbors, _ in iter_knn_search(indexed_structure, query_sequence, k, r, cascade, stats):
+        pass
+    return neighbors
+
+def iter_knn_search(indexed_structure, query_sequence, k, r=None, cascade=None, stats=None, timeout=None, max_dtw_calls=None):
+    """
+    Perform an anytime k-NN search, yielding the k best neighbors found so far as they improve.
+
+    The search is the one of knn_search, but a snapshot of the k best neighbors is yielded
+    after every DTW distance that improves them, and the search can be cut short by a
+    timeout or a budget of DTW calls. Each snapshot says whether it is proven exact, i.e.
+    whether the lower bound at the head of the queue has reached its k-th distance. The
+    last snapshot yielded is the answer of the search: exact if it ran to completion,
+    approximate if the budget ran out first.
+
+    Parameters:
+    - indexed_structure: the indexed structure
+    - query_sequence: the query sequence
+    - k: the number of neighbors to retrieve
+    - r: the warping window (None for the unconstrained DTW)
+    - cascade: the LowerBoundCascade filtering the candidates (by default, every stage with window r)
+    - stats: the SearchStats to record the pruning and timings of the search in, if any (the
+      search is only recorded once the generator is exhausted)
+    - timeout: the number of seconds after which the search stops, if any
+    - max_dtw_calls: the number of DTW computations after which the search stops, if any
+
+    Returns:
+    - A generator of (neighbors, exact) pairs, neighbors being (sequence, distance) pairs sorted by distance
+    """
+    search_started = time.perf_counter()
+    deadline = search_started + timeout if timeout is not None else None
+    query_sequence = np.asarray(query_sequence, dtype=float)
+    if cascade is None:
+        cascade = LowerBoundCascade(query_sequence, r)
+    first_dtw_call = cascade.dtw_calls
+
+    # region of the reduced space (the PAA bounds by default) holding the possible matches
+    reducer = indexed_structure.reducer
+    query_bounds = reduced_query_bounds(indexed_structure, cascade)
+
+    # Init the MinPriorityQueue and the k best entries
     queue = []
-    result = []
+    result = KBest(k)
+    counter = itertools.count() # tie-breaker, nodes and entries are not comparable
 
-    # PAA of the query sequence
-    query_paa = indexed_structure.paa(query_sequence)
+    def snapshot():
+        return [(entry.original_sequence, distance) for entry, distance in result.items()]
+
+    def proven(kth_distance):
+        # nothing left in the queue can be closer than the current k-th neighbor
+        return bool(not queue or queue[0][0] >= kth_distance)
 
     # Push the root node onto the queue with distance 0
-    heapq.heappush(queue, (0, indexed_structure.root))
+    heapq.heappush(queue, (0, next(counter), indexed_structure.root))
 
+    exact = True
     while queue:
-        top_distance, top_node = heapq.heappop(queue)
+        kth_distance = result.kth_distance
+        if ((deadline is not None and time.perf_counter() >= deadline)
+                or (max_dtw_calls is not None and cascade.dtw_calls - first_dtw_call >= max_dtw_calls)):
+            exact = proven(kth_distance)
+            break
+
+        lower_bound, _, top = heapq.heappop(queue)
+        if lower_bound >= kth_distance:
+            if stats is not None:
+                for item in [top] + [item for _, _, item in queue]:
+                    stats.pruned['lb_paa' if isinstance(item, Entry) else 'mindist'] += 1
+            break
 
         # if top is a PAA point
-        if isinstance(top_node, Entry):
-            # Retrieve full sequence from the database
-            full_sequence = indexed_structure.retrieve_full_sequence(top_node.paa_representation)
-
-            # distance between the query sequence and the full sequence
-            actual_distance = dtw_distance(query_sequence, full_sequence)
-            result.append((full_sequence, actual_distance))
-
-            if len(result) == k:  # If we have found k neighbors
-                break
-
-        elif top_node.is_leaf:  # if top is a leaf node
-            for data_item in top_node.entries:
-                # distance or the appropriate lower bound distance
-                distance = dtw_distance(query_paa, data_item.paa_representation)
-                heapq.heappush(queue, (distance, data_item))
-
-        else:  # if top is a non-leaf node
-            for child_node in top_node.entries:
-                distance = mindist(query_paa, child_node.mbr)
-                heapq.heappush(queue, (distance, child_node))
-
-    # Sort the results by distance
-    result.sort(key=lambda x: x[1])
-
-    # Return only the k-nearest neighbors
-    k_nearest_neighbors = result[:k]
-    return k_nearest_neighbors
-
-def range_search(query_paa, epsilon, node, query_sequence, U_hat, L_hat):
-    results = []
-
-    if not node.is_leaf:
-        for child in node.entries:
-            if mindist(query_paa, child.mbr) <= epsilon:
-                results.extend(range_search(query_paa, epsilon, child, query_sequence, U_hat, L_hat))
-    else: # leaf node
-        for entry in node.entries:
-            if lb_paa(entry.paa_representation, U_hat, L_hat) <= epsilon:
-                if dtw_distance(query_sequence, entry.original_sequence) <= epsilon:
-                    results.append(entry.original_sequence)
-
-    # order the results by distance
-    results.sort(key=lambda x: dtw_distance(query_sequence, x))
-    
-    return results
\ No newline at end of file
+        if isinstance(top, Entry):
+            if stats is not None:
+                stats.entries_examined += 1
+            actual_distance = cascade.distance(top.original_sequence, kth_distance, stats=stats)
+            if result.push(actual_distance, top):
+                yield snapshot(), len(result) == k and proven(result.kth_distance)
+
+        else:
+            # LB_PAA of every entry of a leaf (whose lows and highs are the PAA points),
+            # or MINDIST of every child of a non-leaf node, in one call
+            started = time.perf_counter()
+            bounds = node_bounds(reducer, query_bounds, top)
+            kept = np.flatnonzero(bounds < kth_distance)
+            if stats is not None:
+                stats.record_node(top, len(kept), started)
+            for position in kept:
+                if top.is_leaf:
+                    item = Entry(top.lows[position], original_sequence=top.sequences[position], entry_id=int(top.ids[position]))
+                else:
+                    item = top.children[position]
+                heapq.heappush(queue, (bounds[position], next(counter), item))
+
+    if stats is not None:
+        stats.finish(search_started)
+    yield snapshot(), exact
+
+def range_search(indexed_structure, query_sequence, epsilon, r=None, cascade=None, stream=False, stats=None):
+    """
+    Perform a range search on the indexed structure.
+
+    The tree is walked iteratively: a node is only opened if the MINDIST of its MBR is
+    within epsilon, and an entry only reaches the lower bound cascade if its LB_PAA is.
+    The DTW distance of each surviving entry is computed once, abandoned as soon as it
+    exceeds epsilon, and returned alongside the entry.
+
+    Parameters:
+    - indexed_structure: the indexed structure
+    - query_sequence: the query sequence
+    - epsilon: the maximum DTW distance of a match
+    - r: the warping window (None for the unconstrained DTW)
+    - cascade: the LowerBoundCascade filtering the candidates (by default, every stage with window r)
+    - stream: whether to return a generator yielding the matches as they are found
+    - stats: the SearchStats to record the pruning and timings of the search in, if any (when
+      streaming, the search is only recorded once the generator is exhausted)
+
+    Returns:
+    - The (id, distance) pairs of the matches sorted by distance, or a generator of them in discovery order if stream
+    """
+    matches = iter_range_search(indexed_structure, query_sequence, epsilon, r, cascade, stats)
+    if stream:
+        return matches
+    return sorted(matches, key=lambda match: (match[1], match[0]))
+
+def iter_range_search(indexed_structure, query_sequence, epsilon, r=None, cascade=None, stats=None):
+    """Generator behind range_search, yielding the (id, distance) pairs of the matches as they are found."""
+    search_started = time.perf_counter()
+    query_sequence = np.asarray(query_sequence, dtype=float)
+    if cascade is None:
+        cascade = LowerBoundCascade(query_sequence, r)
+    reducer = indexed_structure.reducer
+    query_bounds = reduced_query_bounds(indexed_structure, cascade)
+
+    stack = [indexed_structure.root]
+    while stack:
+        node = stack.pop()
+        started = time.perf_counter()
+        bounds = node_bounds(reducer, query_bounds, node)
+        kept = np.flatnonzero(bounds <= epsilon)
+        if stats is not None:
+            stats.record_node(node, len(kept), started)
+        for position in kept:
+            if not node.is_leaf:
+                stack.append(node.children[position])
+                continue
+            if stats is not None:
+                stats.entries_examined += 1
+            distance = cascade.distance(node.sequences[position], epsilon, stats=stats)
+            if distance <= epsilon:
+                yield int(node.ids[position]), distance
+    if stats is not None:
+        stats.finish(search_started)
@@ -0,0 +1,128 @@
+"""
+This file contains the implementation of the DTW distance and lower bounding measures for
+multivariate time series, given as (L, C) arrays of L synchronized observations of C channels.
+
+The dependent DTW (DTW_D) warps all the channels together, the cost of matching two
+points being their squared euclidean distance over the channels. The independent DTW
+(DTW_I) warps every channel on its own, the squared per-channel distances being summed.
+Both are lower bounded by LB_Kim and LB_Keogh summed over the channels.
+
+Author:
+- Artur Dandolini Pescador
+"""
+
+import numpy as np
+from dtw_functions import dtw_band, dtw_distance
+
+def as_multivariate(time_series):
+    """View a time series as a (L, C) array, a univariate series having a single channel."""
+    time_series = np.asarray(time_series, dtype=float)
+    return time_series[:, None] if time_series.ndim == 1 else time_series
+
+def dtw_distance_dependent(s1, s2, r=None, best_so_far=np.inf, cb=None, stats=None):
+    """
+    Compute the dependent multivariate DTW distance between two time series.
+
+    As in dtw_distance, the path is constrained to a Sakoe-Chiba band of half-width r and
+    the computation is abandoned as soon as a whole row of the band exceeds best_so_far.
+
+    Parameters:
+    - s1: the first (L1, C) time series
+    - s2: the second (L2, C) time series
+    - r: the warping window (None for the unconstrained DTW)
+    - best_so_far: the distance above which the computation is abandoned
+    - cb: the cumulative lower bound residuals, of length L2 + 1, summed over the channels
+      or given per channel as an (L2 + 1, C) array
+    - stats: the SearchStats whose dtw_cells and abandoned_cells counters are updated, if any
+
+    Returns:
+    - The DTW_D distance between s1 and s2, or np.inf if it exceeds best_so_far
+    """
+    s1, s2 = as_multivariate(s1), as_multivariate(s2)
+    if s1.shape[1] != s2.shape[1]:
+        raise ValueError("The time series must have the same number of channels")
+    if cb is not None:
+        cb = np.asarray(cb, dtype=float)
+        cb = (cb.sum(axis=1) if cb.ndim == 2 else cb).tolist()
+
+    def row_costs(i, lo, hi):
+        # squared euclidean distance over the channels
+        return np.sum((s2[lo - 1:hi] - s1[i - 1]) ** 2, axis=1).tolist()
+
+    return dtw_band(len(s1), len(s2), row_costs, r, best_so_far, cb, stats)
+
+def dtw_distance_independent(s1, s2, r=None, best_so_far=np.inf, cb=None, stats=None):
+    """
+    Compute the independent multivariate DTW distance between two time series.
+
+    The channels are processed one after the other, each DTW being abandoned once the
+    channels already computed, plus the lower bounds of those still to come, exceed
+    best_so_far.
+
+    Parameters:
+    - s1: the first (L1, C) time series
+    - s2: the second (L2, C) time series
+    - r: the warping window (None for the unconstrained DTW)
+    - best_so_far: the distance above which the computation is abandoned
+    - cb: the (L2 + 1, C) cumulative lower bound residuals of every channel, if any
+    - stats: the SearchStats whose dtw_cells and abandoned_cells counters are updated, if any
+
+    Returns:
+    - The DTW_I distance between s1 and s2, or np.inf if it exceeds best_so_far
+    """
+    s1, s2 = as_multivariate(s1), as_multivariate(s2)
+    if s1.shape[1] != s2.shape[1]:
+        raise ValueError("The time series must have the same number of channels")
+    if cb is not None:
+        cb = np.asarray(cb, dtype=float)
+        if cb.ndim != 2:
+            cb = None # residuals summed over the channels cannot be split between them
+    # with some slack for rounding, the total deciding exactly
+    budget = best_so_far ** 2 * (1 + 1e-12)
+    total = 0
+    pending = cb[0].sum() if cb is not None else 0 # lower bound of the channels still to come
+    for channel in range(s1.shape[1]):
+        if cb is not None:
+            pending -= cb[0, channel]
+        channel_best = np.sqrt(max(budget - total - pending, 0))
+        distance = dtw_distance(s1[:, channel], s2[:, channel], r, channel_best,
+                                cb[:, channel].tolist() if cb is not None else None, stats)
+        if distance == np.inf:
+            return np.inf
+        total += distance ** 2
+    distance = np.sqrt(total)
+    return distance if distance <= best_so_far else np.inf
+
+def lb_kim_multivariate(s1, s2):
+    """
+    Compute the O(1) LB_Kim lower bound on the first and last points, summed over the channels.
+
+    Parameters:
+    - s1: the first (L1, C) time series
+    - s2: the second (L2, C) time series
+
+    Returns:
+    - The first/last LB_Kim lower bound of both DTW_D and DTW_I between s1 and s2
+    """
+    s1, s2 = as_multivariate(s1), as_multivariate(s2)
+    first, last = np.sum((s1[0] - s2[0]) ** 2), np.sum((s1[-1] - s2[-1]) ** 2)
+    if len(s1) == 1 or len(s2) == 1:
+        return np.sqrt(max(first, last))
+    return np.sqrt(first + last)
+
+def lb_keogh_multivariate(C, U, L):
+    """
+    Calculate the LB_Keogh lower bound between a candidate and the per-channel envelope of a query.
+
+    Parameters:
+    - C: the (L, C) candidate time series
+    - U: the (L, C) upper envelope of the query
+    - L: the (L, C) lower envelope of the query
+
+    Returns:
+    - The LB_Keogh lower bound of both DTW_D and DTW_I between the query and C
+    - The (L, C) squared contribution of each point of each channel of C to the bound
+    """
+    C = as_multivariate(C)
+    contributions = (np.maximum(C - U, 0) + np.maximum(L - C, 0)) ** 2
+    return np.sqrt(np.sum(contributions)), contributions
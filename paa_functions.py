@@ -0,0 +1,61 @@
+"""
+This file contains the implementation of the Piecewise Aggregate Approximation (PAA).
+
+Author:
+- Artur Dandolini Pescador
+"""
+
+import numpy as np
+
+def segment_bounds(length, dims):
+    """
+    Split a series of the given length into dims PAA segments.
+
+    Segment i covers the points [floor(i * length / dims), floor((i + 1) * length / dims)),
+    computed with integer arithmetic so that non-divisible lengths are split exactly.
+
+    Parameters:
+    - length: the length of the time series
+    - dims: the number of dimensions
+
+    Returns:
+    - The start index and the number of points of every segment
+    """
+    if not 1 <= dims <= length:
+        raise ValueError(f"Cannot split a series of length {length} into {dims} PAA segments")
+    starts = (np.arange(dims) * length) // dims
+    return starts, np.diff(np.append(starts, length))
+
+def paa(time_series, dims, expand=False):
+    """
+    Compute the Piecewise Aggregate Approximation (PAA) of a time series, or of every row of a matrix.
+
+    Parameters:
+    - time_series: the time series, or an (N, L) matrix of time series
+    - dims: the number of dimensions
+    - expand: whether to repeat each segment mean over the points of its segment
+
+    Returns:
+    - The PAA representation, with dims values per series, or with the shape of time_series if expand
+    """
+    time_series = np.asarray(time_series, dtype=float)
+    starts, lengths = segment_bounds(time_series.shape[-1], dims)
+    means = np.add.reduceat(time_series, starts, axis=-1) / lengths
+    if expand:
+        return np.repeat(means, lengths, axis=-1)
+    return means
+
+def channel_paa(time_series, dims):
+    """
+    Compute the PAA of every channel of a multivariate time series, concatenated channel after channel.
+
+    Parameters:
+    - time_series: the (L, C) multivariate time series, or an (N, L, C) stack of them
+    - dims: the number of dimensions per channel
+
+    Returns:
+    - The C * dims PAA values of the series, or an (N, C * dims) matrix for a stack
+    """
+    time_series = np.asarray(time_series, dtype=float)
+    means = paa(np.swapaxes(time_series, -1, -2), dims) # (..., C, dims)
+    return means.reshape(means.shape[:-2] + (-1,))
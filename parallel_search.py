@@ -0,0 +1,153 @@
+"""
+This file contains the parallel k-NN and range search answering batches of queries over a
+process pool, the database being placed in shared memory so that the workers never pickle it.
+
+Author:
+- Artur Dandolini Pescador
+"""
+
+import heapq
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import os
+import numpy as np
+from indexing import KBest, LowerBoundCascade
+
+# arrays of the database, attached once per worker process
+_worker_arrays = {}
+
+def _init_worker(specs, reducer):
+    """Map the shared database arrays into the worker process."""
+    for key, (name, shape, dtype) in specs.items():
+        block = shared_memory.SharedMemory(name=name)
+        _worker_arrays[key] = np.ndarray(shape, dtype=dtype, buffer=block.buf)
+        _worker_arrays[key + '_block'] = block # keep the mapping alive
+    _worker_arrays['reducer'] = reducer
+
+def _candidate_bounds(query, r, start, stop):
+    """Cascade of the query and reduced-space lower bound (LB_PAA by default) of the rows [start, stop) of the database."""
+    cascade = LowerBoundCascade(query, r)
+    if len(query) != _worker_arrays['sequences'].shape[1]:
+        # the reduced-space bounds only hold for series of the length of the query
+        return cascade, np.zeros(stop - start)
+    reducer = _worker_arrays['reducer']
+    points = _worker_arrays['paa'][start:stop]
+    return cascade, reducer.mindist(reducer.query_bounds(cascade.envelope), points, points)
+
+def _knn_task(query, k, r, start, stop):
+    """Exact k-NN of a query among the rows [start, stop), visited in increasing LB_PAA order."""
+    sequences = _worker_arrays['sequences']
+    cascade, bounds = _candidate_bounds(query, r, start, stop)
+    result = KBest(k)
+    for index in np.argsort(bounds, kind='stable'):
+        kth_distance = result.kth_distance
+        if bounds[index] >= kth_distance:
+            break
+        result.push(cascade.distance(sequences[start + index], kth_distance), start + index)
+    return result.items()
+
+def _range_task(query, epsilon, r, start, stop):
+    """Rows of [start, stop) within epsilon of the query."""
+    sequences = _worker_arrays['sequences']
+    cascade, bounds = _candidate_bounds(query, r, start, stop)
+    result = []
+    for index in np.flatnonzero(bounds <= epsilon):
+        distance = cascade.distance(sequences[start + index], epsilon)
+        if distance <= epsilon:
+            result.append((start + index, distance))
+    return result
+
+class ParallelSearch:
+    """
+    Process pool answering batches of k-NN and range queries against one indexed structure.
+
+    The series and their PAA representations are copied once into shared memory and the
+    pool is kept alive between calls, so neither the database nor the workers are set up
+    again for each batch. Queries are spread over the workers; when there are fewer
+    queries than workers, the database is also split into partitions searched in
+    parallel, whose results are merged. The answers are exact, as with knn_search.
+
+    Use it as a context manager, or call close() to release the pool and the shared memory.
+    """
+    def __init__(self, indexed_structure, max_workers=None):
+        self.entries = list(indexed_structure.iter_entries())
+        if not self.entries:
+            raise ValueError("Cannot search an empty indexed structure")
+        lengths = {len(entry.original_sequence) for entry in self.entries}
+        if len(lengths) > 1:
+            raise ValueError("ParallelSearch requires all the indexed series to have the same length")
+        self.max_workers = max_workers or os.cpu_count() or 1
+        arrays = {
+            'sequences': np.stack([np.asarray(entry.original_sequence, dtype=float) for entry in self.entries]),
+            'paa': np.stack([entry.paa_representation for entry in self.entries]),
+        }
+        self._blocks = []
+        specs = {}
+        for key, array in arrays.items():
+            block = shared_memory.SharedMemory(create=True, size=array.nbytes)
+            np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[:] = array
+            self._blocks.append(block)
+            specs[key] = (block.name, array.shape, array.dtype.str)
+        self._executor = ProcessPoolExecutor(self.max_workers, initializer=_init_worker,
+                                             initargs=(specs, indexed_structure.reducer))
+
+    def _run(self, task, queries, argument, r):
+        """Submit task for every query and every database partition; results grouped per query."""
+        if len(queries) == 0:
+            return []
+        num_partitions = max(1, self.max_workers // len(queries))
+        cuts = np.linspace(0, len(self.entries), num_partitions + 1).astype(int)
+        futures = [[self._executor.submit(task, np.asarray(query, dtype=float), argument, r, start, stop)
+                    for start, stop in zip(cuts[:-1], cuts[1:]) if start < stop]
+                   for query in queries]
+        return [[match for future in query_futures for match in future.result()] for query_futures in futures]
+
+    def knn_search(self, queries, k, r=None):
+        """
+        Perform an exact k-NN search for every query.
+
+        Parameters:
+        - queries: the query sequences
+        - k: the number of neighbors to retrieve
+        - r: the warping window (None for the unconstrained DTW)
+
+        Returns:
+        - For each query, the k-nearest neighbors as (sequence, distance) pairs sorted by distance
+        """
+        if k <= 0:
+            return [[] for _ in queries]
+        results = self._run(_knn_task, queries, k, r)
+        return [[(self.entries[row].original_sequence, distance)
+                 for row, distance in heapq.nsmallest(k, matches, key=lambda match: (match[1], match[0]))]
+                for matches in results]
+
+    def range_search(self, queries, epsilon, r=None):
+        """
+        Perform a range search for every query.
+
+        Parameters:
+        - queries: the query sequences
+        - epsilon: the maximum DTW distance of a match
+        - r: the warping window (None for the unconstrained DTW)
+
+        Returns:
+        - For each query, the (id, distance) pairs of the matches sorted by distance, as with range_search
+        """
+        results = self._run(_range_task, queries, epsilon, r)
+        return [[(self.entries[row].id, distance)
+                 for row, distance in sorted(matches, key=lambda match: (match[1], self.entries[match[0]].id))]
+                for matches in results]
+
+    def close(self):
+        """Shut the pool down and release the shared memory."""
+        self._executor.shutdown()
+        for block in self._blocks:
+            block.close()
+            block.unlink()
+        self._blocks = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
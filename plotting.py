@@ -6,7 +6,6 @@ Author:
 """
 
 import matplotlib.pyplot as plt
-from dtw_functions import dtw_distance
 
 def plot_timeseries(time_step, sunspots, figsize=(10, 6), label=None, Upper=None, Lower=None):
     plt.figure(figsize=figsize)
@@ -86,8 +85,7 @@ def plot_range_search_results(query_sequence, range_search_results, epsilon=10):
 
     plt.plot(query_sequence, label='Query Sequence', color='black', linewidth=5)
 
-    for i, sequence in enumerate(range_search_results, start=1):
-        distance = dtw_distance(query_sequence, sequence)
+    for i, (sequence, distance) in enumerate(range_search_results, start=1):
         plt.plot(sequence, label=f'Match {i} (Distance (dtw): {distance:.2f})')
 
     plt.title(f'Range Search Results (±{epsilon} range)')
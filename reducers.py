@@ -0,0 +1,291 @@
+"""
+This file contains the dimensionality reductions the indexed structure can index the time series with.
+
+Every reducer maps a series to a point of a few dimensions (reduce), maps the envelope of
+a query to the region of the reduced space holding every series it could match
+(query_bounds), and lower bounds the DTW distance between the query and every series
+inside an MBR of the reduced space (mindist), so that the tree and the searches work the
+same whatever the reduction:
+- PAA: the means of equal-length segments, bounded by LB_PAA
+- APCA: the means of segments whose boundaries are fitted to the data
+- Haar: the first coefficients of the orthonormal Haar wavelet transform
+- SAX: the PAA discretized into symbols by a breakpoint table
+- ChannelPAA: the PAA of every channel of a multivariate series, concatenated
+
+Author:
+- Artur Dandolini Pescador
+"""
+
+from statistics import NormalDist
+import numpy as np
+from dtw_functions import mindist_bounds
+from paa_functions import channel_paa, paa, segment_bounds
+
+class PAA:
+    """Piecewise Aggregate Approximation: the mean of each of dims equal-length segments."""
+    name = 'paa'
+    dtype = float
+
+    def __init__(self, dims):
+        self.dims = dims
+
+    def fit(self, timeseries):
+        """Nothing to learn from the data."""
+        return self
+
+    def reduce(self, timeseries):
+        """PAA of a time series, or of each row of a matrix."""
+        return paa(timeseries, self.dims)
+
+    def query_bounds(self, envelope):
+        """PAA of the upper and lower envelopes, and the number of points of each segment."""
+        U_hat, L_hat = envelope.paa_bounds(self.dims)
+        return U_hat, L_hat, segment_bounds(len(envelope), self.dims)[1]
+
+    def mindist(self, query_bounds, lows, highs):
+        """LB_PAA of the MBRs (lows, highs), weighted by the segment lengths."""
+        U_hat, L_hat, weights = query_bounds
+        return mindist_bounds(U_hat, L_hat, lows, highs, weights)
+
+    def state(self):
+        """Settings of the reducer, as saved in meta.json."""
+        return {'name': self.name, 'dims': self.dims}
+
+class ChannelPAA(PAA):
+    """PAA with segments values per channel of a (L, C) multivariate series, concatenated channel after channel."""
+    name = 'channel_paa'
+
+    def __init__(self, segments, channels):
+        super().__init__(segments * channels)
+        self.segments = segments
+        self.channels = channels
+
+    def reduce(self, timeseries):
+        """PAA of every channel of a multivariate time series, or of each of a stack."""
+        return channel_paa(timeseries, self.segments)
+
+    def query_bounds(self, envelope):
+        """PAA of the per-channel envelopes, and the number of points of each segment."""
+        U_hat, L_hat = envelope.paa_bounds(self.dims)
+        return U_hat, L_hat, np.tile(segment_bounds(len(envelope), self.segments)[1], self.channels)
+
+    def state(self):
+        """Settings of the reducer, as saved in meta.json."""
+        return {'name': self.name, 'segments': self.segments, 'channels': self.channels}
+
+class APCA(PAA):
+    """
+    Adaptive Piecewise Constant Approximation with segment boundaries shared by the dataset.
+
+    fit places the dims segments where the dataset needs them: starting from one segment
+    per point, the two adjacent segments whose merge increases the least the squared
+    reconstruction error summed over the dataset are merged until dims remain. The
+    approximation is then the mean over each segment, bounded by LB_PAA weighted by the
+    segment lengths like PAA, whose uniform segments are used until fit is called.
+    """
+    name = 'apca'
+
+    def __init__(self, dims, starts=None):
+        super().__init__(dims)
+        self.starts = None if starts is None else np.asarray(starts, dtype=int)
+
+    def fit(self, timeseries):
+        """
+        Fit the segment boundaries to a dataset.
+
+        Parameters:
+        - timeseries: the (N, L) matrix of time series
+
+        Returns:
+        - The reducer itself
+        """
+        timeseries = np.atleast_2d(np.asarray(timeseries, dtype=float))
+        n = timeseries.shape[1]
+        segment_bounds(n, self.dims) # validates dims
+        sums = np.concatenate((np.zeros((len(timeseries), 1)), np.cumsum(timeseries, axis=1)), axis=1)
+
+        def energy(a, b):
+            # the squared error of [a, b) is the sum of squares minus this term
+            return np.sum((sums[:, b] - sums[:, a]) ** 2) / (b - a)
+
+        def merge_cost(a, b, c):
+            return energy(a, b) + energy(b, c) - energy(a, c)
+
+        bounds = list(range(n + 1))
+        costs = [merge_cost(bounds[i], bounds[i + 1], bounds[i + 2]) for i in range(n - 1)]
+        while len(bounds) - 1 > self.dims:
+            # costs[i] is the cost of merging the segments i and i + 1
+            i = int(np.argmin(costs))
+            del bounds[i + 1]
+            del costs[i]
+            if i < len(bounds) - 2:
+                costs[i] = merge_cost(bounds[i], bounds[i + 1], bounds[i + 2])
+            if i > 0:
+                costs[i - 1] = merge_cost(bounds[i - 1], bounds[i], bounds[i + 1])
+        self.starts = np.array(bounds[:-1])
+        return self
+
+    def segments(self, length):
+        """Start index and number of points of every segment of a series of the given length."""
+        if self.starts is None:
+            return segment_bounds(length, self.dims)
+        if length <= self.starts[-1]:
+            raise ValueError(f"The segments were fitted to longer series than {length} points")
+        return self.starts, np.diff(np.append(self.starts, length))
+
+    def reduce(self, timeseries):
+        """Mean of every segment of a time series, or of each row of a matrix."""
+        timeseries = np.asarray(timeseries, dtype=float)
+        starts, lengths = self.segments(timeseries.shape[-1])
+        return np.add.reduceat(timeseries, starts, axis=-1) / lengths
+
+    def query_bounds(self, envelope):
+        """Segment means of the upper and lower envelopes, and the number of points of each segment."""
+        return self.reduce(envelope.upper), self.reduce(envelope.lower), self.segments(len(envelope))[1]
+
+    def state(self):
+        """Settings of the reducer, as saved in meta.json."""
+        return {'name': self.name, 'dims': self.dims, 'starts': None if self.starts is None else self.starts.tolist()}
+
+class Haar:
+    """
+    The first dims coefficients of the orthonormal Haar wavelet transform.
+
+    The series are zero-padded to a power of two. The transform being orthonormal, the
+    distance between truncated transforms lower bounds the euclidean distance, and thus
+    LB_Keogh: the envelope is mapped to the box spanning, for every coefficient, its
+    smallest and largest value over the series inside the envelope (the positive weights
+    of the basis vector applied to one envelope, the negative weights to the other).
+    """
+    name = 'haar'
+    dtype = float
+
+    def __init__(self, dims):
+        self.dims = dims
+        self._bases = {}
+
+    def fit(self, timeseries):
+        """Nothing to learn from the data."""
+        return self
+
+    def basis(self, length):
+        """The (dims, length) rows of the Haar basis applied to series of the given length."""
+        if length not in self._bases:
+            size = 1 << max(0, int(length - 1).bit_length())
+            if not 1 <= self.dims <= size:
+                raise ValueError(f"Cannot keep {self.dims} Haar coefficients of a series of length {length}")
+            rows = [np.full(size, 1 / np.sqrt(size))]
+            support = size
+            while len(rows) < self.dims and support > 1:
+                # the wavelets of one level, coarse to fine
+                for start in range(0, size, support):
+                    if len(rows) == self.dims:
+                        break
+                    row = np.zeros(size)
+                    row[start:start + support // 2] = 1 / np.sqrt(support)
+                    row[start + support // 2:start + support] = -1 / np.sqrt(support)
+                    rows.append(row)
+                support //= 2
+            self._bases[length] = np.array(rows)[:, :length]
+        return self._bases[length]
+
+    def reduce(self, timeseries):
+        """Haar coefficients of a time series, or of each row of a matrix."""
+        timeseries = np.asarray(timeseries, dtype=float)
+        return timeseries @ self.basis(timeseries.shape[-1]).T
+
+    def query_bounds(self, envelope):
+        """Largest and smallest coefficients of the series inside the envelope."""
+        basis = self.basis(len(envelope))
+        positive, negative = np.maximum(basis, 0), np.minimum(basis, 0)
+        highs = positive @ envelope.upper + negative @ envelope.lower
+        lows = positive @ envelope.lower + negative @ envelope.upper
+        return highs, lows
+
+    def mindist(self, query_bounds, lows, highs):
+        """Distance between the box of the query and the MBRs (lows, highs)."""
+        query_highs, query_lows = query_bounds
+        return mindist_bounds(query_highs, query_lows, lows, highs)
+
+    def state(self):
+        """Settings of the reducer, as saved in meta.json."""
+        return {'name': self.name, 'dims': self.dims}
+
+class SAX:
+    """
+    Symbolic Aggregate approXimation: the PAA of a series discretized into symbols.
+
+    Symbol s stands for the PAA values between breakpoints s - 1 and s, so the index only
+    stores one byte per segment. The breakpoints are the quantiles of the standard normal
+    distribution, as for z-normalized data, until fit replaces them by the quantiles of the
+    PAA values of a dataset. The lower bound looks the edges of the symbols of an MBR up
+    in the breakpoint table and computes LB_PAA against that range of values.
+    """
+    name = 'sax'
+    dtype = np.uint8
+
+    def __init__(self, dims, alphabet_size=8, breakpoints=None):
+        if not 2 <= alphabet_size <= 256:
+            raise ValueError("The alphabet size must be between 2 and 256")
+        self.dims = dims
+        self.alphabet_size = alphabet_size
+        if breakpoints is None:
+            normal = NormalDist()
+            breakpoints = [normal.inv_cdf(i / alphabet_size) for i in range(1, alphabet_size)]
+        self.set_breakpoints(breakpoints)
+
+    def set_breakpoints(self, breakpoints):
+        """Set the alphabet_size - 1 breakpoints, and the lookup table of the edges of every symbol."""
+        self.breakpoints = np.asarray(breakpoints, dtype=float)
+        if len(self.breakpoints) != self.alphabet_size - 1:
+            raise ValueError(f"{self.alphabet_size} symbols need {self.alphabet_size - 1} breakpoints")
+        self.lower_edges = np.append(-np.inf, self.breakpoints)
+        self.upper_edges = np.append(self.breakpoints, np.inf)
+
+    def fit(self, timeseries):
+        """
+        Place the breakpoints at the quantiles of the PAA values of a dataset, so that the symbols are equiprobable.
+
+        Parameters:
+        - timeseries: the (N, L) matrix of time series
+
+        Returns:
+        - The reducer itself
+        """
+        values = paa(timeseries, self.dims).ravel()
+        self.set_breakpoints(np.quantile(values, np.arange(1, self.alphabet_size) / self.alphabet_size))
+        return self
+
+    def reduce(self, timeseries):
+        """SAX word of a time series, or of each row of a matrix."""
+        return np.searchsorted(self.breakpoints, paa(timeseries, self.dims), side='right').astype(self.dtype)
+
+    def query_bounds(self, envelope):
+        """PAA of the upper and lower envelopes, and the number of points of each segment."""
+        U_hat, L_hat = envelope.paa_bounds(self.dims)
+        return U_hat, L_hat, segment_bounds(len(envelope), self.dims)[1]
+
+    def mindist(self, query_bounds, lows, highs):
+        """LB_PAA between the query and the range of PAA values covered by the symbols of the MBRs."""
+        U_hat, L_hat, weights = query_bounds
+        return mindist_bounds(U_hat, L_hat, self.lower_edges[lows], self.upper_edges[highs], weights)
+
+    def state(self):
+        """Settings of the reducer, as saved in meta.json."""
+        return {'name': self.name, 'dims': self.dims, 'alphabet_size': self.alphabet_size,
+                'breakpoints': self.breakpoints.tolist()}
+
+REDUCERS = {reducer.name: reducer for reducer in (PAA, ChannelPAA, APCA, Haar, SAX)}
+
+def reducer_from_state(state):
+    """
+    Rebuild a reducer from the settings returned by its state().
+
+    Parameters:
+    - state: the settings of the reducer
+
+    Returns:
+    - The reducer
+    """
+    state = dict(state)
+    return REDUCERS[state.pop('name')](**state)
@@ -0,0 +1,92 @@
+"""
+This file contains the implementation of the subsequence similarity search of a query
+over one long time series, in the style of the UCR suite.
+
+Author:
+- Artur Dandolini Pescador
+"""
+
+import numpy as np
+from envelope import compute_envelope
+from indexing import KBest, LowerBoundCascade
+
+def running_mean_std(series, m, block_size=100000):
+    """
+    Compute the mean and standard deviation of every subsequence of length m.
+
+    Both come from running sums of the values and of their squares, so each step of
+    the sliding window costs O(1) instead of a pass over the window. As in the UCR suite,
+    the sums are restarted every block_size offsets, and the values of each block are
+    centered on their mean first, so that the variances are not lost to cancellation
+    on long series far from zero.
+
+    Parameters:
+    - series: the long time series
+    - m: the length of the subsequences
+    - block_size: the number of offsets between two restarts of the running sums
+
+    Returns:
+    - The len(series) - m + 1 means and standard deviations
+    """
+    series = np.asarray(series, dtype=float)
+    num_offsets = len(series) - m + 1
+    means, variances = np.empty(num_offsets), np.empty(num_offsets)
+    for start in range(0, num_offsets, block_size):
+        stop = min(start + block_size, num_offsets)
+        values = series[start:stop + m - 1]
+        center = values.mean()
+        values = values - center
+        sums = np.concatenate(([0], np.cumsum(values)))
+        squared_sums = np.concatenate(([0], np.cumsum(values ** 2)))
+        block_means = (sums[m:] - sums[:-m]) / m
+        variances[start:stop] = (squared_sums[m:] - squared_sums[:-m]) / m - block_means ** 2
+        means[start:stop] = block_means + center
+    return means, np.sqrt(np.maximum(variances, 0))
+
+def subsequence_search(series, query_sequence, r=None, k=1, cascade=None):
+    """
+    Find the subsequences of a long time series closest to a query under the DTW distance.
+
+    The query is slid over every offset of the series. Both the query and each candidate
+    subsequence are z-normalized, the latter on the fly from running means and standard
+    deviations. The envelope of the whole series is computed once: the envelope of every
+    candidate is then a slice of it, normalized like the candidate, which contains the
+    exact envelope of the subsequence. Each offset goes through the lower bound cascade
+    before the early-abandoning DTW.
+
+    Parameters:
+    - series: the long time series
+    - query_sequence: the query sequence
+    - r: the warping window (None for the unconstrained DTW)
+    - k: the number of subsequences to retrieve (overlapping offsets are not excluded)
+    - cascade: the LowerBoundCascade built on the z-normalized query (by default, every stage with window r)
+
+    Returns:
+    - The k best (offset, distance) pairs sorted by distance
+    """
+    series = np.asarray(series, dtype=float)
+    query_sequence = np.asarray(query_sequence, dtype=float)
+    m = len(query_sequence)
+    if m > len(series):
+        raise ValueError("The query is longer than the series")
+    if k < 1:
+        raise ValueError("k must be at least 1")
+
+    if cascade is None:
+        std = query_sequence.std()
+        query = (query_sequence - query_sequence.mean()) / (std if std > 0 else 1)
+        cascade = LowerBoundCascade(query, r)
+    means, stds = running_mean_std(series, m)
+    stds[stds == 0] = 1 # constant subsequences normalize to zeros
+    upper, lower = compute_envelope(series, cascade.r)
+
+    result = KBest(k)
+    for offset in range(len(means)):
+        best_so_far = result.kth_distance
+        window = slice(offset, offset + m)
+        mean, std = means[offset], stds[offset]
+        candidate = (series[window] - mean) / std
+        envelope = ((upper[window] - mean) / std, (lower[window] - mean) / std)
+        result.push(cascade.distance(candidate, best_so_far, envelope), offset)
+
+    return result.items()
@@ -0,0 +1,23 @@
+"""
+This file contains the tests of the DTW k-nearest neighbor classifier.
+
+Author:
+- Artur Dandolini Pescador
+"""
+
+import numpy as np
+import pytest
+from classifier import DTWNearestNeighborClassifier
+
+def test_n_neighbors_must_be_positive():
+    with pytest.raises(ValueError):
+        DTWNearestNeighborClassifier(n_neighbors=0)
+
+@pytest.mark.parametrize('max_workers', [None, 2])
+def test_empty_test_set(max_workers):
+    rng = np.random.default_rng(7)
+    classifier = DTWNearestNeighborClassifier(r=2, n_neighbors=3, max_workers=max_workers)
+    classifier.fit(rng.normal(size=(10, 16)), np.arange(10) % 2)
+    distances, indices = classifier.kneighbors(np.empty((0, 16)))
+    assert distances.shape == indices.shape == (0, 3)
+    assert len(classifier.predict(np.empty((0, 16)))) == 0
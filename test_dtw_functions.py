@@ -0,0 +1,25 @@
+"""
+This file contains the tests of the DTW distance.
+
+Author:
+- Artur Dandolini Pescador
+"""
+
+import numpy as np
+from dtw_functions import dtw_distance
+from multivariate_functions import dtw_distance_dependent, dtw_distance_independent
+
+def test_dtw_distance_is_infinite_above_best_so_far():
+    rng = np.random.default_rng(9)
+    for _ in range(100):
+        s1, s2 = rng.normal(size=(2, 32)).cumsum(axis=1)
+        distance = dtw_distance(s1, s2, 3)
+        assert dtw_distance(s1, s2, 3, best_so_far=0.99 * distance) == np.inf
+        assert dtw_distance(s1, s2, 3, best_so_far=distance) == distance
+
+        m1, m2 = rng.normal(size=(2, 32, 2)).cumsum(axis=1)
+        distance = dtw_distance_dependent(m1, m2, 3)
+        assert dtw_distance_dependent(m1, m2, 3, best_so_far=0.99 * distance) == np.inf
+
+        distance = dtw_distance_independent(m1, m2, 3)
+        assert dtw_distance_independent(m1, m2, 3, best_so_far=0.99 * distance) == np.inf
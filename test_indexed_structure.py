@@ -0,0 +1,123 @@
+"""
+This file contains the tests of the indexed structure: its R-tree invariants and its persistence.
+
+Author:
+- Artur Dandolini Pescador
+"""
+
+import numpy as np
+import pytest
+from batch_functions import dtw_distance_batch
+from indexed_structure import IndexedStructure
+from indexing import knn_search
+
+def check_tree(index):
+    """Assert the R-tree invariants of an indexed structure, returning the number of nodes."""
+    depths, nodes, stack = set(), 0, [(index.root, 1)]
+    while stack:
+        node, depth = stack.pop()
+        nodes += 1
+        assert node.count <= index.max_entries
+        if node is not index.root:
+            assert node.count >= index.min_entries
+        if node.is_leaf:
+            depths.add(depth)
+            for entry_id in node.ids[:node.count]:
+                assert index.leaf_of[int(entry_id)] is node
+            continue
+        assert len(node.children) == node.count
+        for position, child in enumerate(node.children):
+            assert child.parent is node
+            low, high = child.bounds()
+            np.testing.assert_array_equal(node.lows[position], low)
+            np.testing.assert_array_equal(node.highs[position], high)
+            stack.append((child, depth + 1))
+    assert depths <= {index.height()}
+    assert sum(1 for _ in index.iter_entries()) == len(index.leaf_of)
+    return nodes
+
+def test_save_open_round_trip(tmp_path):
+    rng = np.random.default_rng(0)
+    timeseries = rng.normal(size=(50, 32)).cumsum(axis=1)
+    IndexedStructure.bulk_load(timeseries, 4, max_entries=8).save(tmp_path)
+
+    index = IndexedStructure.open(tmp_path)
+    for entry_id in range(len(timeseries)):
+        np.testing.assert_array_equal(index.sequence(entry_id), timeseries[entry_id])
+
+def test_save_after_open_to_the_same_directory(tmp_path):
+    rng = np.random.default_rng(1)
+    timeseries = rng.normal(size=(50, 32)).cumsum(axis=1)
+    IndexedStructure.bulk_load(timeseries, 4, max_entries=8).save(tmp_path)
+
+    # the opened series are rows of the memory-mapped file that save() overwrites
+    index = IndexedStructure.open(tmp_path)
+    new_series = rng.normal(size=32).cumsum()
+    new_id = index.insert(new_series)
+    index.save(tmp_path)
+
+    reopened = IndexedStructure.open(tmp_path)
+    for entry_id in range(len(timeseries)):
+        np.testing.assert_array_equal(reopened.sequence(entry_id), timeseries[entry_id])
+    np.testing.assert_array_equal(reopened.sequence(new_id), new_series)
+
+def test_save_series_inserted_as_lists(tmp_path):
+    index = IndexedStructure(4)
+    for offset in range(100):
+        index.insert(list(range(offset, offset + 16)))
+    index.save(tmp_path)
+
+    reopened = IndexedStructure.open(tmp_path)
+    for offset in range(100):
+        np.testing.assert_array_equal(reopened.sequence(offset), np.arange(offset, offset + 16))
+
+def test_min_entries_is_at_least_two():
+    assert IndexedStructure(4, max_entries=4).min_entries == 2
+    with pytest.raises(ValueError):
+        IndexedStructure(4, max_entries=8, min_entries=1)
+    with pytest.raises(ValueError):
+        IndexedStructure(4, max_entries=3)
+
+def test_small_fan_out_stays_balanced_after_inserts_and_deletes():
+    rng = np.random.default_rng(2)
+    index = IndexedStructure(4, max_entries=4)
+    ids = [index.insert(rng.normal(size=32).cumsum()) for _ in range(1000)]
+    nodes = check_tree(index)
+    # every node but the root holds at least min_entries children
+    assert index.height() <= 1 + np.log(1000) / np.log(index.min_entries)
+    assert nodes <= 1000
+
+    for entry_id in rng.permutation(ids)[:600]:
+        index.delete(int(entry_id))
+    check_tree(index)
+    assert index.height() <= 1 + np.log(400) / np.log(index.min_entries)
+
+@pytest.mark.parametrize('max_entries', [4, 8])
+def test_random_inserts_deletes_updates_and_ingests(max_entries):
+    rng = np.random.default_rng(max_entries)
+    index = IndexedStructure(4, max_entries=max_entries)
+    stored = {}
+    for step in range(1500):
+        operation = rng.random()
+        if operation < 0.45 or not stored:
+            sequence = rng.normal(size=24).cumsum()
+            stored[index.insert(sequence)] = sequence
+        elif operation < 0.75:
+            entry_id = int(rng.choice(list(stored)))
+            np.testing.assert_array_equal(index.delete(entry_id), stored.pop(entry_id))
+        elif operation < 0.9:
+            entry_id = int(rng.choice(list(stored)))
+            stored[entry_id] = rng.normal(size=24).cumsum()
+            index.update(entry_id, stored[entry_id])
+        else:
+            batch = list(rng.normal(size=(int(rng.integers(1, 20)), 24)).cumsum(axis=1))
+            stored.update(zip(index.ingest(batch, batch_size=8), batch))
+
+        if step % 100 == 99:
+            check_tree(index)
+            assert set(index.leaf_of) == set(stored)
+            ids = list(stored)
+            query = rng.normal(size=24).cumsum()
+            distances = dtw_distance_batch(query, np.array([stored[entry_id] for entry_id in ids]), 2)
+            neighbors = knn_search(index, query, 5, 2)
+            np.testing.assert_allclose([distance for _, distance in neighbors], np.sort(distances)[:5])
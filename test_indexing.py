@@ -0,0 +1,43 @@
+"""
+This file contains the tests of the k-NN and range searches.
+
+Author:
+- Artur Dandolini Pescador
+"""
+
+import numpy as np
+from dtw_functions import dtw_distance
+from indexed_structure import IndexedStructure
+from indexing import iter_knn_search, knn_search, range_search
+
+def test_searches_are_exact_for_series_of_different_lengths():
+    rng = np.random.default_rng(3)
+    for _ in range(50):
+        timeseries = [rng.normal(size=rng.integers(8, 41)).cumsum() for _ in range(12)]
+        index = IndexedStructure(4)
+        for sequence in timeseries:
+            index.insert(sequence)
+        query = rng.normal(size=rng.integers(8, 41)).cumsum()
+        distances = np.array([dtw_distance(query, sequence, 2) for sequence in timeseries])
+
+        neighbors = knn_search(index, query, 3, 2)
+        np.testing.assert_allclose([distance for _, distance in neighbors], np.sort(distances)[:3])
+        epsilon = np.sort(distances)[1:3].mean()
+        matches = range_search(index, query, epsilon, 2)
+        assert [entry_id for entry_id, _ in matches] == sorted(np.flatnonzero(distances <= epsilon).tolist(), key=lambda i: (distances[i], i))
+
+def test_knn_search_without_neighbors():
+    rng = np.random.default_rng(4)
+    index = IndexedStructure.bulk_load(rng.normal(size=(20, 16)).cumsum(axis=1), 4)
+    assert knn_search(index, rng.normal(size=16).cumsum(), 0) == []
+
+def test_anytime_knn_search_reports_python_bools():
+    rng = np.random.default_rng(5)
+    timeseries = rng.normal(size=(300, 32)).cumsum(axis=1)
+    index = IndexedStructure.bulk_load(timeseries, 4)
+    query = rng.normal(size=32).cumsum()
+    snapshots = list(iter_knn_search(index, query, 3, 2))
+    assert all(type(exact) is bool for _, exact in snapshots)
+    assert snapshots[-1][1]
+    _, exact = list(iter_knn_search(index, query, 3, 2, max_dtw_calls=1))[-1]
+    assert type(exact) is bool
@@ -0,0 +1,22 @@
+"""
+This file contains the tests of the parallel batch searches.
+
+Author:
+- Artur Dandolini Pescador
+"""
+
+import numpy as np
+from indexed_structure import IndexedStructure
+from indexing import knn_search
+from parallel_search import ParallelSearch
+
+def test_parallel_knn_search_matches_the_serial_one():
+    rng = np.random.default_rng(6)
+    index = IndexedStructure.bulk_load(rng.normal(size=(200, 32)).cumsum(axis=1), 4)
+    queries = rng.normal(size=(3, 32)).cumsum(axis=1)
+    with ParallelSearch(index, max_workers=2) as search:
+        for k in (0, 1, 5):
+            for query, neighbors in zip(queries, search.knn_search(queries, k, 2)):
+                serial = knn_search(index, query, k, 2)
+                np.testing.assert_allclose([distance for _, distance in neighbors], [distance for _, distance in serial])
+        assert search.knn_search([], 3) == []
@@ -0,0 +1,53 @@
+"""
+This file contains the tests of the dimensionality reductions of the indexed structure.
+
+Author:
+- Artur Dandolini Pescador
+"""
+
+import numpy as np
+import pytest
+from batch_functions import dtw_distance_batch
+from envelope import Envelope
+from indexed_structure import IndexedStructure
+from indexing import knn_search, range_search
+from reducers import APCA, PAA, SAX, Haar
+
+REDUCERS = {
+    'paa': lambda: PAA(8),
+    'apca': lambda: APCA(8),
+    'haar': lambda: Haar(8),
+    'sax': lambda: SAX(8, alphabet_size=16),
+}
+
+@pytest.mark.parametrize('name', sorted(REDUCERS))
+def test_searches_are_exact_with_every_reducer(name, tmp_path):
+    rng = np.random.default_rng(10)
+    timeseries = rng.normal(size=(400, 48)).cumsum(axis=1)
+    timeseries = (timeseries - timeseries.mean(axis=1, keepdims=True)) / timeseries.std(axis=1, keepdims=True)
+    index = IndexedStructure.bulk_load(timeseries[:300], 8, max_entries=8, reducer=REDUCERS[name]())
+    stored = dict(enumerate(timeseries[:300]))
+    for sequence in timeseries[300:]:
+        stored[index.insert(sequence)] = sequence
+    for entry_id in rng.choice(list(stored), 100, replace=False):
+        index.delete(int(entry_id))
+        del stored[int(entry_id)]
+    index.save(tmp_path)
+
+    ids = np.array(list(stored))
+    for searched in (index, IndexedStructure.open(tmp_path)):
+        for _ in range(5):
+            query = timeseries[rng.integers(len(timeseries))] + rng.normal(scale=0.3, size=48)
+            distances = dtw_distance_batch(query, np.array([stored[entry_id] for entry_id in ids]), 3)
+            order = np.argsort(distances, kind='stable')
+
+            reducer = searched.reducer
+            points = reducer.reduce(np.array([stored[entry_id] for entry_id in ids]))
+            bounds = reducer.mindist(reducer.query_bounds(Envelope(query, 3)), points, points)
+            assert np.all(bounds <= distances + 1e-9)
+
+            neighbors = knn_search(searched, query, 5, 3)
+            np.testing.assert_allclose([distance for _, distance in neighbors], distances[order[:5]])
+            epsilon = distances[order[10:12]].mean()
+            matches = range_search(searched, query, epsilon, 3)
+            assert sorted(entry_id for entry_id, _ in matches) == sorted(ids[distances <= epsilon].tolist())
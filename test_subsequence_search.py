@@ -0,0 +1,25 @@
+"""
+This file contains the tests of the subsequence similarity search.
+
+Author:
+- Artur Dandolini Pescador
+"""
+
+import numpy as np
+import pytest
+from numpy.lib.stride_tricks import sliding_window_view
+from subsequence_search import running_mean_std, subsequence_search
+
+def test_running_mean_std_of_a_long_offset_series():
+    rng = np.random.default_rng(0)
+    series = 1e4 + rng.uniform(-0.5, 0.5, 500000)
+    means, stds = running_mean_std(series, 128, block_size=50000)
+    windows = sliding_window_view(series, 128)[::997]
+    np.testing.assert_allclose(means[::997], windows.mean(axis=1), rtol=1e-12)
+    np.testing.assert_allclose(stds[::997], windows.std(axis=1), rtol=1e-9)
+
+@pytest.mark.parametrize('k', [0, -1])
+def test_subsequence_search_needs_a_positive_k(k):
+    rng = np.random.default_rng(8)
+    with pytest.raises(ValueError):
+        subsequence_search(rng.normal(size=200).cumsum(), rng.normal(size=16).cumsum(), 2, k)